@@ -0,0 +1,77 @@
+"""Benchmark for the word drawing cache of the typesetter (--draw-cache).
+
+Typesets the given chapters to PDF with the drawing cache off and on, and
+prints the time and the size of the output for each. Needs the full
+typesetter environment, fonts and data included:
+
+    python benchmarks/draw_cache_bench.py path/to/quran-data --chapters 1 2
+"""
+
+import argparse
+import importlib.util
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench(typesetter, chapters, filename, repeat, draw_cache):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        typesetter.main(chapters, filename, True, None, 1, draw_cache)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, os.path.getsize(filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drawing cache benchmark.")
+    parser.add_argument(
+        "datadir", metavar="DATADIR", help="Directory containing input files"
+    )
+    parser.add_argument(
+        "--chapters",
+        "-c",
+        metavar="N",
+        nargs="*",
+        type=int,
+        default=range(1, 115),
+        help="Which chapters to typeset (Default: all)",
+    )
+    parser.add_argument("--repeat", metavar="N", type=int, default=3, help="Runs")
+    args = parser.parse_args()
+
+    typesetter = load_module("typesetter", os.path.join(ROOT, "quran-typesetter.py"))
+    typesetter.logger.setLevel(logging.ERROR)
+
+    all_chapters = typesetter.read_data(args.datadir)
+    if all_chapters is None:
+        sys.exit(1)
+    chapters = [all_chapters[i - 1] for i in args.chapters]
+
+    print("draw cache     time        size")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for draw_cache in (False, True):
+            filename = os.path.join(tmpdir, "out-%d.pdf" % draw_cache)
+            elapsed, size = bench(
+                typesetter, chapters, filename, args.repeat, draw_cache
+            )
+            mode = "on" if draw_cache else "off"
+            print("%10s %7.3fs %10d" % (mode, elapsed, size))
+
+
+if __name__ == "__main__":
+    main()
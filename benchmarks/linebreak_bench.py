@@ -0,0 +1,192 @@
+"""Microbenchmark for linebreak.NodeList.compute_breakpoints().
+
+Times breaking the longest chapters with the settings used by the
+typesetter (tolerance=4, looseness=10). The paragraphs are either shaped
+from real data (needs the full typesetter environment, fonts included) or
+synthetic paragraphs with the same number of words.
+
+Pass --reference with the path of another linebreak.py to compare against
+it, e.g. one from an older revision:
+
+    git show HEAD~1:linebreak.py > /tmp/linebreak_old.py
+    python benchmarks/linebreak_bench.py --reference /tmp/linebreak_old.py
+
+Pass --beam-width to also break with active node pruning, and report its
+effects against the exact breaks:
+
+    python benchmarks/linebreak_bench.py --beam-width 16 64 256
+"""
+
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import linebreak
+
+# Approximate number of words in the longest chapters.
+CHAPTER_WORDS = {2: 6144, 4: 3763, 3: 3503, 7: 3344, 5: 2837}
+
+SPACE = 3.2
+TEXT_WIDTHS = [205]
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_paragraph(words, seed):
+    """Returns a NodeList with roughly the metrics of the typesetter output."""
+
+    rnd = random.Random(seed)
+    nodes = linebreak.NodeList()
+    for i in range(words):
+        if i:
+            if rnd.random() < 0.05:
+                # No-break space before aya numbers.
+                nodes.append(linebreak.Penalty(width=0, penalty=linebreak.INFINITY))
+            nodes.append(
+                linebreak.Glue(width=SPACE, stretch=SPACE / 2, shrink=SPACE / 1.5)
+            )
+        nodes.append(linebreak.Box(width=rnd.uniform(8, 45)))
+    nodes.add_closing_penalty()
+    return nodes
+
+
+def shaped_paragraphs(datadir, numbers):
+    """Returns NodeLists shaped by the typesetter from real data."""
+
+    typesetter = load_module("typesetter", os.path.join(ROOT, "quran-typesetter.py"))
+    chapters = typesetter.read_data(datadir)
+    doc = typesetter.Document([], None)
+    return [doc.shaper.shape_paragraph(chapters[i - 1].text) for i in numbers]
+
+
+def convert(nodes, module):
+    """Copies the node metrics into a NodeList of another linebreak module."""
+
+    result = module.NodeList()
+    for node in nodes:
+        args = dict(width=node.width, stretch=node.stretch, shrink=node.shrink)
+        if node.is_box:
+            result.append(module.Box(**args))
+        elif node.is_glue:
+            result.append(module.Glue(**args))
+        else:
+            result.append(
+                module.Penalty(
+                    width=node.width, penalty=node.penalty, flagged=node.flagged
+                )
+            )
+    return result
+
+
+def bench(nodes, repeat, **kwargs):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        breaks = nodes.compute_breakpoints(
+            TEXT_WIDTHS, tolerance=4, looseness=10, **kwargs
+        )
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, breaks
+
+
+def bench_pruning(numbers, paragraphs, beam_widths, repeat, engine):
+    """
+    Prints the effects of each beam width against the exact breaks. The
+    demerit delta is the difference in the total demerits of the chosen
+    lines; the breaker does not minimise that total, so pruning can also
+    find breaks with fewer.
+    """
+
+    print()
+    print("chapter    beam    time  visited  max active   pruned   demerit delta")
+    for number, nodes in zip(numbers, paragraphs):
+        for beam_width in [None] + beam_widths:
+            elapsed, breaks = bench(nodes, repeat, engine=engine, beam_width=beam_width)
+            stats = nodes.stats
+            if beam_width is None:
+                exact = breaks, stats["demerits"]
+                beam = "exact"
+            else:
+                beam = str(beam_width)
+            line = "%7d %7s %7.3fs %8d %11d %8d" % (
+                number,
+                beam,
+                elapsed,
+                stats["visited"],
+                stats["max_active"],
+                stats["pruned"],
+            )
+            if beam_width is not None:
+                line += " %15.6g" % (stats["demerits"] - exact[1])
+                if breaks != exact[0]:
+                    line += "  (%+d lines)" % (len(breaks) - len(exact[0]))
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Line breaking benchmark.")
+    parser.add_argument(
+        "--data", metavar="DATADIR", help="Shape real chapters from DATADIR"
+    )
+    parser.add_argument(
+        "--reference", metavar="FILE", help="Another linebreak.py to compare with"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("python", "numpy"),
+        default="python",
+        help="Line breaking engine to time (Default: python)",
+    )
+    parser.add_argument(
+        "--repeat", metavar="N", type=int, default=3, help="Runs per chapter"
+    )
+    parser.add_argument(
+        "--beam-width",
+        metavar="N",
+        nargs="+",
+        type=int,
+        default=[],
+        help="Also report the effects of pruning to these beam widths",
+    )
+    args = parser.parse_args()
+
+    numbers = list(CHAPTER_WORDS)
+    if args.data:
+        paragraphs = shaped_paragraphs(args.data, numbers)
+    else:
+        paragraphs = [synthetic_paragraph(CHAPTER_WORDS[i], i) for i in numbers]
+
+    reference = None
+    if args.reference:
+        reference = load_module("linebreak_reference", args.reference)
+
+    print("chapter   nodes    time   ref time  speedup")
+    for number, nodes in zip(numbers, paragraphs):
+        elapsed, breaks = bench(nodes, args.repeat, engine=args.engine)
+        line = "%7d %7d %7.3fs" % (number, len(nodes), elapsed)
+        if reference:
+            ref_elapsed, ref_breaks = bench(convert(nodes, reference), args.repeat)
+            line += " %9.3fs %7.2fx" % (ref_elapsed, ref_elapsed / elapsed)
+            if breaks != ref_breaks:
+                line += "  (breaks differ!)"
+        print(line)
+
+    if args.beam_width:
+        bench_pruning(numbers, paragraphs, args.beam_width, args.repeat, args.engine)
+
+
+if __name__ == "__main__":
+    main()
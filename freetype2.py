@@ -1201,6 +1201,7 @@ ft.FT_Done_FreeType.argtypes = (ct.c_void_p,)
 ft.FT_Library_Version.argtypes = (ct.c_void_p, ct.c_void_p, ct.c_void_p, ct.c_void_p)
 ft.FT_New_Face.argtypes = (ct.c_void_p, ct.c_void_p, ct.c_long, ct.c_void_p)
 # ft.FT_New_face.argtypes = (FT.Library?, ct.c_char_p, ct.c_int, ct.POINTER(FT.Face))
+ft.FT_New_Memory_Face.argtypes = (ct.c_void_p, ct.c_void_p, ct.c_long, ct.c_long, ct.c_void_p)
 ft.FT_Reference_Face.argtypes = (ct.c_void_p,)
 ft.FT_Done_Face.argtypes = (ct.c_void_p,)
 ft.FT_Get_X11_Font_Format.restype = ct.c_char_p
@@ -1873,6 +1874,21 @@ class Library :
             Face(self, result_face, filename)
     #end new_face
 
+    def new_memory_face(self, data, face_index = 0) :
+        "loads an FT.Face from font data in memory and returns a Face object for it." \
+        " data must be a bytes object. FreeType does not copy it, so the caller must" \
+        " keep it alive for as long as the face is in use, including by other libraries" \
+        " holding references to the face, like Cairo. The same data can be shared by" \
+        " any number of faces."
+        if not isinstance(data, bytes) :
+            raise TypeError("data must be bytes")
+        #end if
+        result_face = FT.Face()
+        check(ft.FT_New_Memory_Face(self.lib, data, len(data), face_index, ct.byref(result_face)))
+        return \
+            Face(self, result_face, None)
+    #end new_memory_face
+
     def find_face(self, pattern) :
         "finds a font file by trying to match a Fontconfig pattern string, loads an FT.Face" \
         " from it and returns a Face object."
@@ -2034,6 +2050,14 @@ class Face :
             get_default_lib().new_face(filename, face_index)
     #end new
 
+    @staticmethod
+    def new_memory(data, face_index = 0) :
+        "loads an FT.Face from font data in memory and returns a Face object for it." \
+        " See Library.new_memory_face for the lifetime of data."
+        return \
+            get_default_lib().new_memory_face(data, face_index)
+    #end new_memory
+
     @staticmethod
     def find(pattern) :
         "finds a font file by trying to match a Fontconfig pattern string, loads an FT.Face" \
@@ -1274,6 +1274,24 @@ def seq_to_ct(seq, ct_type, conv = lambda x : x, zeroterm = False) :
         result
 #end seq_to_ct
 
+def _struct_array_fields(addr, ct_struct, nr_elts, typecode, field_names) :
+    "copies a C array of nr_elts ct_struct elements at address addr in bulk, and" \
+    " returns a list of array.array objects, one per named field. The fields must" \
+    " all have the size of the array typecode."
+    struct_size = ct.sizeof(ct_struct)
+    raw = array.array(typecode, bytes(nr_elts * struct_size))
+    if nr_elts != 0 :
+        ct.memmove(raw.buffer_info()[0], addr, nr_elts * struct_size)
+    #end if
+    stride = struct_size // raw.itemsize
+    return \
+        list \
+          (
+            raw[getattr(ct_struct, name).offset // raw.itemsize :: stride]
+            for name in field_names
+          )
+#end _struct_array_fields
+
 def shaper_list_to_hb(shaper_list) :
     "converts a list of strings to a null-terminated ctypes array of" \
     " pointers to char. Returns a tuple of 3 items: the number of shaper" \
@@ -3372,6 +3390,42 @@ class Buffer :
             tuple(GlyphPosition.from_hb(arr[i], self.autoscale) for i in range(nr_glyphs.value))
     #end glyph_positions
 
+    @property
+    def glyph_info_arrays(self) :
+        "returns a tuple of two array.array objects, the codepoint and cluster fields" \
+        " of all the glyph infos. This copies the infos in bulk without creating a" \
+        " GlyphInfo object per glyph."
+        nr_glyphs = ct.c_uint()
+        infos = hb.hb_buffer_get_glyph_infos(self._hbobj, ct.byref(nr_glyphs))
+        raw = _struct_array_fields \
+          (
+            infos, HB.glyph_info_t, nr_glyphs.value, "I",
+            ("codepoint", "cluster")
+          )
+        return \
+            tuple(raw)
+    #end glyph_info_arrays
+
+    @property
+    def glyph_position_arrays(self) :
+        "returns a tuple of four array.array objects, the x_advance, y_advance," \
+        " x_offset and y_offset fields of all the glyph positions. This copies the" \
+        " positions in bulk without creating a GlyphPosition object per glyph. Values" \
+        " are scaled like those of glyph_positions."
+        nr_glyphs = ct.c_uint()
+        positions = hb.hb_buffer_get_glyph_positions(self._hbobj, ct.byref(nr_glyphs))
+        raw = _struct_array_fields \
+          (
+            positions, HB.glyph_position_t, nr_glyphs.value, "i",
+            ("x_advance", "y_advance", "x_offset", "y_offset")
+          )
+        if self.autoscale :
+            raw = (array.array("d", (HB.from_position_t(v) for v in a)) for a in raw)
+        #end if
+        return \
+            tuple(raw)
+    #end glyph_position_arrays
+
     if qahirah != None :
 
         def get_glyphs(self, origin = None) :
@@ -3380,24 +3434,24 @@ class Buffer :
             " be optionally offset by the specified Vector origin. The signs of the" \
             " y-coordinates are flipped to correspond to the usual Cairo convention" \
             " of increasing downwards."
-            glyph_infos = self.glyph_infos
-            glyph_positions = self.glyph_positions
+            codepoints, _ = self.glyph_info_arrays
+            x_advances, y_advances, x_offsets, y_offsets = self.glyph_position_arrays
             result = []
             if origin != None :
-                pos = origin
+                x, y = origin
             else :
-                pos = qahirah.Vector(0, 0)
+                x, y = 0, 0
             #end if
-            flip = qahirah.Vector(1, -1)
-            for i in range(len(glyph_infos)) :
+            for i in range(len(codepoints)) :
                 result.append \
                   (
-                    qahirah.Glyph(glyph_infos[i].codepoint, pos + flip * glyph_positions[i].offset)
+                    qahirah.Glyph(codepoints[i], (x + x_offsets[i], y - y_offsets[i]))
                   )
-                pos += flip * glyph_positions[i].advance
+                x += x_advances[i]
+                y -= y_advances[i]
             #end for
             return \
-                (result, pos)
+                (result, qahirah.Vector(x, y))
         #end get_glyphs
 
     #end if
@@ -4855,6 +4909,44 @@ class Font :
             result
     #end get_glyph_v_advance
 
+    if hasattr(hb, "hb_font_get_glyph_h_advances") :
+
+        def get_glyph_h_advances(self, glyphs) :
+            "returns the horizontal advances of a sequence of glyph indices as an" \
+            " array.array, in one call. Values are scaled like those of" \
+            " get_glyph_h_advance."
+            nr_glyphs = len(glyphs)
+            c_glyphs = (nr_glyphs * HB.codepoint_t)(*glyphs)
+            c_advances = (nr_glyphs * HB.position_t)()
+            hb.hb_font_get_glyph_h_advances \
+              (
+                self._hbobj,
+                nr_glyphs,
+                c_glyphs, ct.sizeof(HB.codepoint_t),
+                c_advances, ct.sizeof(HB.position_t)
+              )
+            result = array.array("i", c_advances)
+            if self.autoscale :
+                result = array.array("d", (HB.from_position_t(v) for v in result))
+            #end if
+            return \
+                result
+        #end get_glyph_h_advances
+
+    else :
+
+        def get_glyph_h_advances(self, glyphs) :
+            "returns the horizontal advances of a sequence of glyph indices as an" \
+            " array.array. This HarfBuzz is too old to get them in one call, so" \
+            " they are got one by one with get_glyph_h_advance."
+            result = array.array("d" if self.autoscale else "i")
+            result.extend(self.get_glyph_h_advance(g) for g in glyphs)
+            return \
+                result
+        #end get_glyph_h_advances
+
+    #end if
+
     def get_glyph_h_origin(self, glyph) :
         x = HB.position_t()
         y = HB.position_t()
@@ -38,12 +38,25 @@ Reference:
 
 from __future__ import print_function
 
+import hashlib
 import sys
+from array import array
 
-__version__ = "1.01"
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Bump this when the breaks computed for the same input change, the
+# typesetter caches them by it.
+__version__ = "1.02"
 
 INFINITY = 1000
 
+# Default of Item.compute_width(), standing for the item's own ratio, as
+# None stands for no adjustment.
+_OWN_RATIO = object()
+
 # Three classes defining the three different types of nides that
 # can go into an NodeList.
 
@@ -56,8 +69,11 @@ class Item:
         self.is_box = self.is_glue = self.is_penalty = False
         self._forced_break = None
 
-    def compute_width(self):
-        r = self.ratio
+    def compute_width(self, ratio=_OWN_RATIO):
+        """Returns the width of the item adjusted by ratio, or by its own
+        ratio if none is given. A ratio of None means no adjustment."""
+
+        r = self.ratio if ratio is _OWN_RATIO else ratio
         if r is None:
             return self.width
 
@@ -111,6 +127,12 @@ class _BreakNode:
         self.totalshrink, self.demerits = totalshrink, demerits
         self.previous = previous
 
+        # The demerits are those of the line ending here, these are the
+        # demerits of all the lines up to here.
+        self.total_demerits = demerits
+        if previous is not None:
+            self.total_demerits += previous.total_demerits
+
     def __repr__(self):
         return "<_BreakNode at %i>" % self.position
 
@@ -124,12 +146,95 @@ class NodeList(list):
     # Set this to True to trace the execution of the algorithm.
     debug = False
 
+    # Smallest active node list the numpy engine evaluates in a batch,
+    # below that the per-node loop is faster.
+    numpy_threshold = 64
+
+    # Statistics of the last compute_breakpoints() run: the number of
+    # active nodes visited ("visited"), the most active nodes at once
+    # ("max_active"), the number of nodes pruned ("pruned"), and the sum
+    # of the demerits of the chosen lines ("demerits").
+    stats = None
+
     def add_closing_penalty(self):
         "Add the standard glue and penalty for the end of a paragraph"
         self.append(Penalty(width=0, penalty=INFINITY, flagged=0))
         self.append(Glue(width=0, stretch=INFINITY, shrink=0))
         self.append(Penalty(width=0, penalty=-INFINITY, flagged=1))
 
+    def compute_fingerprint(self):
+        """Return a hex digest of the kind and metrics of the nodes.
+        compute_breakpoints() breaks NodeLists with the same fingerprint
+        the same way, given the same arguments, so it can be used to
+        look up earlier results.
+        """
+
+        metrics = array("d")
+        for node in self:
+            metrics.extend(
+                (
+                    node.is_box,
+                    node.is_glue,
+                    node.width,
+                    node.stretch,
+                    node.shrink,
+                    node.penalty,
+                    node.flagged,
+                )
+            )
+        return hashlib.sha256(metrics.tobytes()).hexdigest()
+
+    def compute_sums(self, widths=None):
+        """Precompute the running sums of width, stretch, and shrink
+        (W,Y,Z in the original paper).  These make it easy to measure the
+        width/stretch/shrink between two indexes; just compute
+        sum_*[pos2] - sum_*[pos1].  Note that sum_*[i] is the total
+        up to but not including the box at position i, and that the
+        sums have one more element than the list, holding the totals.
+
+        widths : an optional iterable used instead of the node widths.
+        """
+
+        m = len(self)
+        if widths is None:
+            widths = (node.width for node in self)
+
+        self.sum_width = sum_width = array("d", bytes(8 * (m + 1)))
+        self.sum_stretch = sum_stretch = array("d", bytes(8 * (m + 1)))
+        self.sum_shrink = sum_shrink = array("d", bytes(8 * (m + 1)))
+        width_sum = stretch_sum = shrink_sum = 0
+        for i, (node, width) in enumerate(zip(self, widths)):
+            width_sum += width
+            stretch_sum += node.stretch
+            shrink_sum += node.shrink
+
+            sum_width[i + 1] = width_sum
+            sum_stretch[i + 1] = stretch_sum
+            sum_shrink[i + 1] = shrink_sum
+
+    def compute_columns(self):
+        """Precompute the per-node values the main loop of
+        compute_breakpoints() needs, as compact arrays: penalty, flagged,
+        whether the node is a feasible breakpoint and whether it is a
+        forced break.
+        """
+
+        m = len(self)
+        self.penalties = p = array("d", bytes(8 * m))
+        self.flags = f = array("b", bytes(m))
+        self.feasible = feasible = array("b", bytes(m))
+        self.forced = forced = array("b", bytes(m))
+        previous_is_box = False
+        for i, node in enumerate(self):
+            p[i] = node.penalty
+            f[i] = node.flagged
+            if node.is_penalty:
+                feasible[i] = node.penalty < INFINITY
+                forced[i] = node.penalty == -INFINITY
+            elif node.is_glue:
+                feasible[i] = previous_is_box
+            previous_is_box = node.is_box
+
     def is_feasible_breakpoint(self, i):
         "Return true if position 'i' is a feasible breakpoint."
 
@@ -204,6 +309,27 @@ class NodeList(list):
 
         return r
 
+    def compute_lines(self, breakpoints, line_lengths):
+        """Return the lines between the breakpoints returned by
+        compute_breakpoints(), as a tuple of (start, end, ratio) tuples:
+        the line holds the nodes from start up to but not including end,
+        and its glue is adjusted by ratio, see Item.compute_width().
+        The first line starts at the first breakpoint, and each other
+        line right after the breakpoint before it.
+
+        The nodes themselves are left unchanged, so the same NodeList
+        can be broken again, e.g. for other line lengths.
+        """
+
+        lines = []
+        start = breakpoints[0]
+        for line, end in enumerate(breakpoints[1:]):
+            ratio = self.compute_adjustment_ratio(start, end, line, line_lengths)
+            lines.append((start, end, ratio))
+            start = end + 1
+
+        return tuple(lines)
+
     def add_active_nodes(self, active_nodes, nodes):
         """Add nodes to the active node list.
         The nodes are added so that the list of active nodes is always
@@ -238,6 +364,149 @@ class NodeList(list):
 
             active_nodes.insert(insert_index, node)
 
+    def prune_active_nodes(self, active_nodes, i, line_lengths, beam_width):
+        """Keep at most beam_width of the active nodes at position 'i',
+        if given, for each line that has its own length in line_lengths
+        and for all the lines after those, and update the statistics.
+        Such nodes can all be followed by the same breaks, so pruning
+        never leaves the paragraph without a way to the end.  Nodes
+        ending different numbers of lines are compared by their demerits
+        per line.
+        """
+
+        stats = self.stats
+        stats["max_active"] = max(stats["max_active"], len(active_nodes))
+        if beam_width is None:
+            return
+
+        nodes = [A for A in active_nodes if A.position == i]
+        if len(nodes) <= beam_width:
+            return
+
+        last = len(line_lengths) - 1
+        groups = {}
+        for A in nodes:
+            groups.setdefault(min(A.line, last), []).append(A)
+        pruned = set()
+        for nodes in groups.values():
+            if len(nodes) > beam_width:
+                nodes = sorted(nodes, key=lambda A: A.total_demerits / A.line)
+                pruned.update(map(id, nodes[beam_width:]))
+        if not pruned:
+            return
+
+        active_nodes[:] = [A for A in active_nodes if id(A) not in pruned]
+        if self.debug:
+            print("\tPruned", len(pruned), "nodes")
+        stats["pruned"] += len(pruned)
+
+    def compute_feasible_breaks(
+        self,
+        i,
+        active_nodes,
+        line_lengths,
+        tolerance,
+        fitness_demerit,
+        flagged_demerit,
+    ):
+        """Batched version of the inner loop of compute_breakpoints(),
+        using NumPy.  Computes the adjustment ratio, demerits and fitness
+        class of the lines from all active nodes to position 'i' at once,
+        removes the nodes that can no longer start a line, and
+        returns the list of feasible breaks at 'i'.
+        """
+
+        nodes = list(active_nodes)
+        count = len(nodes)
+        position = numpy.fromiter((A.position for A in nodes), numpy.intp, count)
+        line = numpy.fromiter((A.line for A in nodes), numpy.intp, count)
+        previous_class = numpy.fromiter(
+            (A.fitness_class for A in nodes), numpy.intp, count
+        )
+
+        sum_width = numpy.frombuffer(self.sum_width)
+        sum_stretch = numpy.frombuffer(self.sum_stretch)
+        sum_shrink = numpy.frombuffer(self.sum_shrink)
+
+        # Same arithmetic as compute_adjustment_ratio().
+        length = sum_width[i] - sum_width[position]
+        if self[i].is_penalty:
+            length = length + self[i].width
+        lengths = numpy.asarray(line_lengths, dtype=numpy.float64)
+        available_length = lengths[numpy.minimum(line, len(line_lengths) - 1)]
+        y = sum_stretch[i] - sum_stretch[position]
+        z = sum_shrink[i] - sum_shrink[position]
+
+        r = numpy.zeros(count)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            short = length < available_length
+            r[short] = numpy.where(
+                y[short] > 0,
+                (available_length[short] - length[short]) / y[short],
+                INFINITY,
+            )
+            long = length > available_length
+            r[long] = numpy.where(
+                z[long] > 0,
+                (available_length[long] - length[long]) / z[long],
+                INFINITY,
+            )
+
+        # Deactivate nodes in the same order as the reference loop, so that
+        # the same node is kept when only one is left.
+        forced = self.forced[i]
+        removed = set()
+        for k in numpy.flatnonzero((r < -1) | bool(forced)).tolist():
+            if count - len(removed) > 1:
+                removed.add(k)
+        if removed:
+            active_nodes[:] = [A for k, A in enumerate(nodes) if k not in removed]
+
+        selected = numpy.flatnonzero((-1 <= r) & (r <= tolerance))
+        if not len(selected):
+            return []
+
+        r = r[selected]
+        p = self.penalties[i]
+        badness = 1 + 100 * numpy.abs(r) ** 3
+        if p >= 0:
+            demerits = (badness + p) ** 3
+        elif forced:
+            demerits = badness**2 - p**2
+        else:
+            demerits = badness**2
+
+        f = numpy.frombuffer(self.flags, dtype=numpy.int8)
+        flagged = f[position[selected]].astype(numpy.float64)
+        demerits = demerits + (flagged_demerit * self.flags[i] * flagged)
+
+        fitness_class = numpy.select([r < -0.5, r <= 0.5, r <= 1], [0, 1, 2], default=3)
+        demerits = numpy.where(
+            numpy.abs(fitness_class - previous_class[selected]) > 1,
+            demerits + fitness_demerit,
+            demerits,
+        )
+
+        breaks = []
+        for k, fitness_class, demerits in zip(
+            selected.tolist(), fitness_class.tolist(), demerits.tolist()
+        ):
+            A = nodes[k]
+            breaks.append(
+                _BreakNode(
+                    position=i,
+                    line=A.line + 1,
+                    fitness_class=fitness_class,
+                    totalwidth=self.sum_width[i],
+                    totalstretch=self.sum_stretch[i],
+                    totalshrink=self.sum_shrink[i],
+                    demerits=demerits,
+                    previous=A,
+                )
+            )
+
+        return breaks
+
     def compute_breakpoints(
         self,
         line_lengths,
@@ -245,6 +514,8 @@ class NodeList(list):
         tolerance=1,  # rho in the paper
         fitness_demerit=100,  # gamma (XXX?) in the paper
         flagged_demerit=100,  # alpha in the paper
+        engine="python",
+        beam_width=None,
     ):
         """Compute a list of optimal breakpoints for the paragraph
         represented by this NodeList, returning them as a list of
@@ -266,45 +537,39 @@ class NodeList(list):
         flagged_demerit : additional value added to the demerit score
                           when breaking at the second of two flagged
                           penalties.
+        engine : "python" evaluates each active node in turn, "numpy"
+                 evaluates the whole active set for a breakpoint in one
+                 batched operation (when it has at least numpy_threshold
+                 nodes) and needs NumPy.  Both return the same breaks.
+        beam_width : if given, at most that many active nodes at each
+                     breakpoint, the ones with the least demerits per
+                     line, are kept.  This bounds the time and memory
+                     for long paragraphs, but the breaks may no longer
+                     be optimal; see the stats attribute and
+                     prune_active_nodes() for the effects.
         """
 
+        if engine == "numpy":
+            if numpy is None:
+                raise RuntimeError("The numpy engine needs NumPy installed")
+        elif engine != "python":
+            raise ValueError("Unknown engine: %r" % engine)
+        if beam_width is not None and beam_width < 1:
+            raise ValueError("Beam width must be at least 1: %r" % beam_width)
+
         m = len(self)
         if m == 0:
             return []  # No text, so no breaks
 
-        # Precompute lists containing the numeric values for each node.
-        # The variable names follow those in Knuth's description.
-        w = [0] * m
-        y = [0] * m
-        z = [0] * m
-        p = [0] * m
-        f = [0] * m
-        for i in range(m):
-            node = self[i]
-            w[i] = node.width
-            y[i] = node.stretch
-            z[i] = node.shrink
-            p[i] = node.penalty
-            f[i] = node.flagged
-
-        # Precompute the running sums of width, stretch, and shrink
-        # (W,Y,Z in the original paper).  These make it easy to measure the
-        # width/stretch/shrink between two indexes; just compute
-        # sum_*[pos2] - sum_*[pos1].  Note that sum_*[i] is the total
-        # up to but not including the box at position i.
-        self.sum_width = {}
-        self.sum_stretch = {}
-        self.sum_shrink = {}
-        width_sum = stretch_sum = shrink_sum = 0
-        for i in range(m):
-            self.sum_width[i] = width_sum
-            self.sum_stretch[i] = stretch_sum
-            self.sum_shrink[i] = shrink_sum
-
-            node = self[i]
-            width_sum += node.width
-            stretch_sum += node.stretch
-            shrink_sum += node.shrink
+        # Precompute arrays containing the numeric values for each node,
+        # and the running sums of width, stretch, and shrink.
+        self.compute_columns()
+        self.compute_sums()
+        p, f = self.penalties, self.flags
+        feasible, forced = self.feasible, self.forced
+        sum_width = self.sum_width
+        sum_stretch = self.sum_stretch
+        sum_shrink = self.sum_shrink
 
         # Initialize list of active nodes to a single break at the
         # beginning of the text.
@@ -318,15 +583,15 @@ class NodeList(list):
             demerits=0,
         )
         active_nodes = [A]
+        stats = self.stats = dict(visited=0, max_active=1, pruned=0, demerits=0)
 
         if self.debug:
             print("Looping over %i nodes" % m)
 
         for i in range(m):
-            B = self[i]
             # Determine if this box is a feasible breakpoint and
             # perform the main loop if it is.
-            if self.is_feasible_breakpoint(i):
+            if feasible[i]:
                 if self.debug:
                     print("Feasible breakpoint at %i:" % i)
                     print("\tCurrent active node list:", active_nodes)
@@ -336,16 +601,34 @@ class NodeList(list):
                     def key_f(n):
                         return (n.line, n.position, n.fitness_class)
 
-                    active_nodes.sort(key=key_f)
-                    for A in active_nodes:
+                    for A in sorted(active_nodes, key=key_f):
                         print(A.position, A.line, A.fitness_class)
                     print
                     print
 
+                stats["visited"] += len(active_nodes)
+                if engine == "numpy" and len(active_nodes) >= self.numpy_threshold:
+                    breaks = self.compute_feasible_breaks(
+                        i,
+                        active_nodes,
+                        line_lengths,
+                        tolerance,
+                        fitness_demerit,
+                        flagged_demerit,
+                    )
+                    if breaks:
+                        self.add_active_nodes(active_nodes, breaks)
+                        self.prune_active_nodes(
+                            active_nodes, i, line_lengths, beam_width
+                        )
+                    continue
+
                 # Loop over the list of active nodes, and compute the fitness
                 # of the line formed by breaking at A and B.  The resulting
                 breaks = []  # List of feasible breaks
-                for A in active_nodes[:]:
+                kept = []  # Active nodes left after this breakpoint
+                removed = 0
+                for A in active_nodes:
                     r = self.compute_adjustment_ratio(
                         A.position, i, A.line, line_lengths
                     )
@@ -355,23 +638,26 @@ class NodeList(list):
 
                     # XXX is 'or' really correct here?  This seems to
                     # remove all active nodes on encountering a forced break!
-                    if r < -1 or B.is_forced_break:
+                    if r < -1 or forced[i]:
                         # Deactivate node A
-                        if len(active_nodes) == 1:
+                        if len(active_nodes) - removed == 1:
                             if self.debug:
                                 print("Can't remove last node!")
                                 # XXX how should this be handled?
                                 # Raise an exception?
+                            kept.append(A)
                         else:
                             if self.debug:
                                 print("\tRemoving node", A)
-                            active_nodes.remove(A)
+                            removed += 1
+                    else:
+                        kept.append(A)
 
                     if -1 <= r <= tolerance:
                         # Compute demerits and fitness class
                         if p[i] >= 0:
                             demerits = (1 + 100 * abs(r) ** 3 + p[i]) ** 3
-                        elif B.is_forced_break:
+                        elif forced[i]:
                             demerits = (1 + 100 * abs(r) ** 3) ** 2 - p[i] ** 2
                         else:
                             demerits = (1 + 100 * abs(r) ** 3) ** 2
@@ -404,23 +690,26 @@ class NodeList(list):
                             position=i,
                             line=A.line + 1,
                             fitness_class=fitness_class,
-                            totalwidth=self.sum_width[i],
-                            totalstretch=self.sum_stretch[i],
-                            totalshrink=self.sum_shrink[i],
+                            totalwidth=sum_width[i],
+                            totalstretch=sum_stretch[i],
+                            totalshrink=sum_shrink[i],
                             demerits=demerits,
                             previous=A,
                         )
                         breaks.append(brk)
                         if self.debug:
-                            print("\tRecording feasible break", B)
+                            print("\tRecording feasible break", self[i])
                             print("\t\tDemerits=", demerits)
                             print("\t\tFitness class=", fitness_class)
 
                 # end for A in active_nodes
+                if removed:
+                    active_nodes[:] = kept
                 if breaks:
                     if self.debug:
                         print("List of breaks at ", i, ":", breaks)
                     self.add_active_nodes(active_nodes, breaks)
+                    self.prune_active_nodes(active_nodes, i, line_lengths, beam_width)
             # end if self.feasible_breakpoint()
         # end for i in range(m)
 
@@ -439,6 +728,7 @@ class NodeList(list):
 
             best = 0
             d = INFINITY
+            b = A
             for br in active_nodes:
                 delta = br.line - A.line
                 # The two branches of this 'if' statement
@@ -459,6 +749,7 @@ class NodeList(list):
 
         # Use the chosen node A to determine the optimum breakpoints,
         # and return the resulting list of breakpoints.
+        stats["demerits"] = A.total_demerits
         breaks = []
         while A is not None:
             breaks.append(A.position)
@@ -0,0 +1,84 @@
+"""
+Helpers for keeping typesetter state between runs, and for sending it
+between processes.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+logger = logging.getLogger("typesetter")
+
+
+def cache_path(cache_dir, prefix, version, key):
+    """
+    Returns the path of a cache file in cache_dir, named after prefix and a
+    digest of the cache format version and of key, i.e. everything else the
+    cached data depends on.
+    """
+
+    digest = hashlib.sha256(repr((version, key)).encode("utf-8"))
+    return os.path.join(cache_dir, "%s-%s.pickle" % (prefix, digest.hexdigest()[:16]))
+
+
+def load_pickle(path, what):
+    """
+    Returns the data pickled to path, or None if the file is missing or
+    unreadable, logging it as what, e.g. “word cache”.
+    """
+
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        logger.info("%s not found: %s", what[0].upper() + what[1:], path)
+    except Exception as e:
+        # Unpickling garbage can raise about anything.
+        logger.warning("Ignoring unreadable %s %s: %s", what, path, e)
+
+    return None
+
+
+def save_pickle(path, data):
+    """
+    Pickles data to path, creating its directory if needed. The file is
+    replaced at once, so readers never see it half written. Each writer
+    uses its own temporary file, so concurrent builds sharing a cache
+    directory don't write over each other; the last one to finish wins.
+    """
+
+    dirname = os.path.dirname(path)
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def node_to_tuple(node):
+    """
+    Returns a plain, picklable representation of a node: its kind followed by
+    the fields returned by its to_tuple() method.
+    """
+
+    return (node.kind,) + node.to_tuple()
+
+
+def node_from_tuple(doc, t, kinds):
+    """
+    Creates a node from the output of node_to_tuple(), using the from_tuple()
+    class method of its class in kinds, a dictionary of node classes keyed by
+    their kind.
+    """
+
+    kind = t[0]
+    if kind not in kinds:
+        raise ValueError("Unknown node kind: %r" % kind)
+
+    return kinds[kind].from_tuple(doc, t[1:])
@@ -985,6 +985,8 @@ cairo.cairo_surface_reference.restype = ct.c_void_p
 cairo.cairo_surface_reference.argtypes = (ct.c_void_p,)
 cairo.cairo_surface_destroy.argtypes = (ct.c_void_p,)
 cairo.cairo_surface_flush.argtypes = (ct.c_void_p,)
+cairo.cairo_surface_finish.argtypes = (ct.c_void_p,)
+cairo.cairo_surface_set_user_data.argtypes = (ct.c_void_p, ct.c_void_p, ct.c_void_p, CAIRO.destroy_func_t)
 cairo.cairo_surface_get_device.restype = ct.c_void_p
 cairo.cairo_surface_get_device.argtypes = (ct.c_void_p,)
 cairo.cairo_surface_get_font_options.argtypes = (ct.c_void_p, ct.c_void_p)
@@ -1349,6 +1351,7 @@ if HAS.XLIB_SURFACE :
 #end if
 
 _ft_destroy_key = ct.c_int() # dummy address
+_write_flush_key = ct.c_int() # dummy address
 
 if freetype2 != None :
 
@@ -2566,7 +2569,12 @@ def offset_glyphs(glyphs, offset) :
 #end offset_glyphs
 
 def glyphs_to_cairo(glyphs) :
-    "converts a sequence of Glyph objects to Cairo form."
+    "converts a sequence of Glyph objects to Cairo form. A GlyphRun is already" \
+    " in Cairo form, and its array is returned without any conversion."
+    if isinstance(glyphs, GlyphRun) :
+        return \
+            glyphs._cairobj, glyphs.nr_glyphs
+    #end if
     nr_glyphs = len(glyphs)
     buf = (nr_glyphs * CAIRO.glyph_t)()
     for i in range(nr_glyphs) :
@@ -2577,6 +2585,107 @@ def glyphs_to_cairo(glyphs) :
         buf, nr_glyphs
 #end glyphs_to_cairo
 
+class GlyphRun :
+    "a sequence of glyphs converted once to Cairo form. It can be passed wherever" \
+    " a sequence of Glyph objects is accepted, e.g. to Context.show_glyphs," \
+    " show_text_glyphs and glyph_extents, any number of times without being" \
+    " converted again. Treat it as immutable: use translated() to get a run at a" \
+    " different position."
+
+    __slots__ = ("_cairobj", "nr_glyphs") # to forestall typos
+
+    def __init__(self, glyphs) :
+        self._cairobj, self.nr_glyphs = glyphs_to_cairo(glyphs)
+    #end __init__
+
+    def __len__(self) :
+        return \
+            self.nr_glyphs
+    #end __len__
+
+    def __getitem__(self, i) :
+        "returns the Glyph at index i."
+        if i < 0 :
+            i += self.nr_glyphs
+        #end if
+        if i < 0 or i >= self.nr_glyphs :
+            raise IndexError("GlyphRun index out of range")
+        #end if
+        glyph = self._cairobj[i]
+        return \
+            Glyph(glyph.index, (glyph.x, glyph.y))
+    #end __getitem__
+
+    def translated(self, offset) :
+        "returns a new GlyphRun with all the glyph positions offset by the specified" \
+        " Vector. The Cairo array is copied in bulk and adjusted in place, without" \
+        " creating any Glyph objects."
+        offset = Vector.from_tuple(offset)
+        result = GlyphRun.__new__(GlyphRun)
+        buf = (self.nr_glyphs * CAIRO.glyph_t)()
+        ct.memmove(buf, self._cairobj, ct.sizeof(buf))
+        for glyph in buf :
+            glyph.x += offset.x
+            glyph.y += offset.y
+        #end for
+        result._cairobj = buf
+        result.nr_glyphs = self.nr_glyphs
+        return \
+            result
+    #end translated
+
+    def __repr__(self) :
+        return \
+            "GlyphRun(%s)" % repr(list(self))
+    #end __repr__
+
+#end GlyphRun
+
+class TextGlyphRun :
+    "text, glyphs and cluster information converted once to Cairo form, for" \
+    " rendering any number of times with Context.show_text_glyph_run. The arguments" \
+    " are as for Context.show_text_glyphs; the text is encoded to UTF-8 and the" \
+    " cluster lengths converted to bytes here, once. glyphs may be a GlyphRun, which" \
+    " is then shared rather than copied."
+
+    __slots__ = ("c_text", "glyphs", "_cairobj", "nr_clusters", "cluster_flags") # to forestall typos
+
+    def __init__(self, text, glyphs, clusters, cluster_flags) :
+        encode = not isinstance(text, bytes)
+        nr_clusters = len(clusters)
+        if encode :
+            c_text = text.encode("utf-8")
+            e_clusters = []
+            pos = 0
+            for c in clusters :
+                # convert cluster num_chars to num_bytes
+                next_pos = pos + c[0]
+                e_clusters.append \
+                  (
+                    (len(text[pos:next_pos].encode()), c[1])
+                  )
+                pos = next_pos
+            #end for
+        else :
+            c_text = text
+            e_clusters = clusters
+        #end if
+        if not isinstance(glyphs, GlyphRun) :
+            glyphs = GlyphRun(glyphs)
+        #end if
+        c_clusters = (nr_clusters * CAIRO.cluster_t)()
+        for i, c in enumerate(e_clusters) :
+            c_clusters[i] = CAIRO.cluster_t(c[0], c[1])
+        #end for
+        self.c_text = c_text
+        self.glyphs = glyphs
+        self._cairobj = c_clusters
+        self.nr_clusters = nr_clusters
+        self.cluster_flags = cluster_flags
+    #end __init__
+
+#end TextGlyphRun
+
 default_tolerance = 0.1 # for flattening paths
 
 #+
@@ -3640,8 +3749,8 @@ class Context :
     #end show_text
 
     def show_glyphs(self, glyphs) :
-        "glyphs must be a sequence of Glyph objects, to be rendered starting" \
-        " at the specified positions."
+        "glyphs must be a sequence of Glyph objects or a GlyphRun, to be rendered" \
+        " starting at the specified positions."
         buf, nr_glyphs = glyphs_to_cairo(glyphs)
         cairo.cairo_show_glyphs(self._cairobj, ct.byref(buf), nr_glyphs)
         return \
@@ -3653,38 +3762,31 @@ class Context :
         " (for, e.g., searching/indexing/selection purposes) if the back-end supports" \
         " it. clusters is a sequence of 2-tuples, (nr_chars/nr_bytes, nr_glyphs); the" \
         " first element of each pair is a number of characters if text is a Unicode string," \
-        " a number of bytes if text is a bytes object. If cluster_flags has" \
+        " a number of bytes if text is a bytes object. glyphs may also be a GlyphRun." \
+        " If cluster_flags has" \
         " CAIRO.TEXT_CLUSTER_FLAG_BACKWARD, set, then the numbers of glyphs in the clusters" \
         " count from the end of the Glyphs array, not from the start."
-        encode = not isinstance(text, bytes)
-        nr_clusters = len(clusters)
-        if encode :
-            c_text = text.encode("utf-8")
-            e_clusters = []
-            pos = 0
-            for c in clusters :
-                # convert cluster num_chars to num_bytes
-                next_pos = pos + c[0]
-                e_clusters.append \
-                  (
-                    (len(text[pos:next_pos].encode()), c[1])
-                  )
-                pos = next_pos
-            #end for
-        else :
-            c_text = text
-            e_clusters = clusters
-        #end if
-        c_glyphs, nr_glyphs = glyphs_to_cairo(glyphs)
-        c_clusters = (nr_clusters * CAIRO.cluster_t)()
-        for i, c in enumerate(e_clusters) :
-            c_clusters[i] = CAIRO.cluster_t(c[0], c[1])
-        #end for
-        cairo.cairo_show_text_glyphs(self._cairobj, c_text, len(c_text), ct.byref(c_glyphs), nr_glyphs, ct.byref(c_clusters), nr_clusters, cluster_flags)
+        self.show_text_glyph_run(TextGlyphRun(text, glyphs, clusters, cluster_flags))
         return \
             self
     #end show_text_glyphs
 
+    def show_text_glyph_run(self, run) :
+        "displays a TextGlyphRun, as show_text_glyphs would display the text, glyphs," \
+        " clusters and cluster_flags it was created from, with a single Cairo call and" \
+        " no conversion."
+        cairo.cairo_show_text_glyphs \
+          (
+            self._cairobj,
+            run.c_text, len(run.c_text),
+            ct.byref(run.glyphs._cairobj), run.glyphs.nr_glyphs,
+            ct.byref(run._cairobj), run.nr_clusters,
+            run.cluster_flags
+          )
+        return \
+            self
+    #end show_text_glyph_run
+
     @property
     def font_extents(self) :
         "returns a FontExtents object giving information about the current font settings."
@@ -3736,6 +3838,36 @@ def file_write_func(fileobj) :
         write_data
 #end file_write_func
 
+def _buffered_file_write_funcs(fileobj, buffer_size) :
+    "returns a write_func like file_write_func does, except that it collects the data" \
+    " and writes it to fileobj in chunks of at least buffer_size bytes, and a" \
+    " destroy_func that writes out whatever is left. Cairo calls write_func with" \
+    " many small pieces, so this saves a lot of write calls."
+
+    buf = bytearray()
+
+    def write_data(_, data, length) :
+        buf.extend(ct.string_at(data, length))
+        if len(buf) >= buffer_size :
+            fileobj.write(bytes(buf))
+            del buf[:]
+        #end if
+        return \
+            CAIRO.STATUS_SUCCESS
+    #end write_data
+
+    def flush_data(_) :
+        if len(buf) != 0 :
+            fileobj.write(bytes(buf))
+            del buf[:]
+        #end if
+    #end flush_data
+
+#begin _buffered_file_write_funcs
+    return \
+        (write_data, flush_data)
+#end _buffered_file_write_funcs
+
 class Surface :
     "base class for Cairo surfaces. Do not instantiate directly; use create methods" \
     " provided by subclasses."
@@ -3819,6 +3951,16 @@ class Surface :
             self
     #end flush
 
+    def finish(self) :
+        "finishes the Surface and drops its references to external resources. A" \
+        " Surface writing to a file or stream writes out whatever it still holds," \
+        " e.g. the PDF font subsets and trailer. Nothing more can be drawn to it" \
+        " after this, even while references to it remain."
+        cairo.cairo_surface_finish(self._cairobj)
+        return \
+            self
+    #end finish
+
     @property
     def device(self) :
         "returns the Device for this Surface."
@@ -4218,9 +4360,12 @@ class PDFSurface(Surface) :
     #end create_for_stream
 
     @classmethod
-    def create_for_file(celf, outfile, dimensions_in_points) :
+    def create_for_file(celf, outfile, dimensions_in_points, buffer_size = 0) :
         "creates a PDF surface that outputs to the specified file-like object." \
-        " For io.IOBase and subclasses, this should be faster than using create_for_stream."
+        " For io.IOBase and subclasses, this should be faster than using create_for_stream." \
+        " If buffer_size is nonzero, the output is written to outfile in chunks of at" \
+        " least that many bytes, with the remainder written when the surface is" \
+        " finished or destroyed."
 
         def write_data(_, data, length) :
             s = ct.string_at(data, length)
@@ -4230,10 +4375,41 @@ class PDFSurface(Surface) :
         #end write_data
 
     #begin create_for_file
+        if buffer_size == 0 :
+            result = celf.create_for_stream(write_data, None, dimensions_in_points)
+        else :
+            write_data, flush_data = _buffered_file_write_funcs(outfile, buffer_size)
+            result = celf.create_for_stream(write_data, None, dimensions_in_points)
+            c_flush_data = CAIRO.destroy_func_t(flush_data)
+            check(cairo.cairo_surface_set_user_data
+              (
+                result._cairobj,
+                ct.byref(_write_flush_key),
+                None,
+                c_flush_data
+              ))
+            result._write_func = (result._write_func, c_flush_data)
+            _dependent_src[result] = result._write_func
+              # to ensure they don’t disappear unexpectedly, even while a Context
+              # still holds on to the surface after this object is gone
+        #end if
         return \
-            celf.create_for_stream(write_data, None, dimensions_in_points)
+            result
     #end create_for_file
 
+    def finish(self) :
+        "finishes the Surface, as Surface.finish does. For a buffered create_for_file" \
+        " Surface, also writes out what is left in the buffer, as the trailer of the" \
+        " PDF only gets there now."
+        super().finish()
+        write_func = getattr(self, "_write_func", None)
+        if isinstance(write_func, tuple) :
+            write_func[1](None)
+        #end if
+        return \
+            self
+    #end finish
+
     def restrict_to_version(self, version) :
         "restricts the version of PDF file created. If used, should" \
         " be called before any actual drawing is done."
@@ -1,11 +1,27 @@
+import hashlib
+import itertools
+import json
 import logging
 import math
+import multiprocessing
+import os
+import socket
+import socketserver
+import stat
+import time
 import unicodedata
 
 import harfbuzz as hb
 import qahirah as qh
 
 import linebreak
+from persist import (
+    cache_path,
+    load_pickle,
+    node_from_tuple,
+    node_to_tuple,
+    save_pickle,
+)
 
 ft = qh.get_ft_lib()
 
@@ -17,12 +33,29 @@ Q_STR = "\u06DE\u00A0"
 Q_PUA = 0x100000
 P_STR = "\u06E9"
 
+# Buffer settings used for shaping all words.
+BUFFER_SCRIPT = hb.HARFBUZZ.SCRIPT_ARABIC
+BUFFER_LANGUAGE = "ar"
+BUFFER_CLUSTER_LEVEL = hb.HARFBUZZ.BUFFER_CLUSTER_LEVEL_MONOTONE_CHARACTERS
+
 
 class Document:
     """Class representing the main document and holding document-wide settings
     and state."""
 
-    def __init__(self, chapters, filename, decorations=True):
+    def __init__(
+        self,
+        chapters,
+        filename,
+        decorations=True,
+        cache_dir=None,
+        jobs=1,
+        draw_cache=False,
+        images=None,
+        settings=None,
+        resident=None,
+        paragraphs=None,
+    ):
         logger.info("Initializing the document: %s", filename)
 
         # Settungs
@@ -38,25 +71,113 @@ class Document:
         self.top_margin = 105  # ~1.46
         self.outer_margin = 100  # ~1.4in
         self.page_number_ypos = 460  # ~6.4in
+        # Size of the chunks written to output streams.
+        self.write_buffer_size = 1 << 20
+
+        # Override any of the layout settings above.
+        if settings:
+            for name, value in settings.items():
+                setattr(self, name, value)
 
         self.page_decorations = decorations
 
-        # Cache for shaped words.
-        self.word_cache = {}
-        self.shaper = Shaper(self)
+        # Number of worker processes for shaping and line breaking.
+        self.jobs = jobs
+
+        # Cache for shaped words, persisted to cache_dir if one is given.
+        # resident, if given, is a dictionary that outlives the document, and
+        # keeps the word cache, the shaper and the Cairo font face for later
+        # documents using the same cache_dir and font.
+        self.cache_dir = cache_dir
+        if resident is None:
+            resident = {}
+        key = (cache_dir, self.body_font, self.body_font_size)
+        if key not in resident:
+            resident[key] = {
+                "word_cache": WordCache(cache_dir),
+                "break_cache": BreakCache(cache_dir),
+            }
+        self.resident = resident[key]
+        self.word_cache = self.resident["word_cache"]
+        # Cache for line breaks of shaped paragraphs, persisted the same way.
+        self.break_cache = self.resident["break_cache"]
+        self.break_cache.load(linebreak.__version__)
+        if "shaper" not in self.resident:
+            self.resident["shaper"] = Shaper(self)
+        self.shaper = self.resident["shaper"]
+        self.shaper.doc = self
+
+        # Shaped chapter text, keyed by chapter digest, if given. Documents of
+        # a batch share it, see typeset_batch().
+        self.paragraphs = paragraphs
+
+        # Lines of already processed chapters, persisted to cache_dir too.
+        self.manifest = BuildManifest(cache_dir)
+
+        # Recordings of drawn words, keyed by word text, if enabled.
+        self.word_recordings = {} if draw_cache else None
+
+        # Page images to draw along with, or instead of, the PDF.
+        self.images = images
+
+        # The PDF output is written to filename, which can also be a writable
+        # binary file object. Documents used by worker processes never draw
+        # anything.
+        self.filename = filename
+        if filename is not None or images is not None:
+            if "font_face" not in self.resident:
+                # Create a new FreeType face for Cairo, as sometimes Cairo
+                # mangles the char size, breaking HarfBuzz positions when it
+                # uses the same face.
+                ft_face = ft.find_face(self.body_font)
+                self.resident["font_face"] = qh.FontFace.create_for_ft_face(ft_face)
+            self.font_face = self.resident["font_face"]
+        if filename is not None:
+            size = (self.page_width, self.page_height)
+            if isinstance(filename, str):
+                self.surface = qh.PDFSurface.create(filename, size)
+            else:
+                self.surface = qh.PDFSurface.create_for_file(
+                    filename, size, self.write_buffer_size
+                )
+            self.cr = self.create_context(self.surface)
+
+        self.chapters = chapters
+
+    def create_context(self, surface):
+        """Creates a drawing context for the surface, set up for the text."""
 
-        self.surface = qh.PDFSurface.create(
-            filename, (self.page_width, self.page_height)
-        )
-        # Create a new FreeType face for Cairo, as sometimes Cairo mangles the
-        # char size, breaking HarfBuzz positions when it uses the same face.
-        ft_face = ft.find_face(self.body_font)
-        cr = self.cr = qh.Context.create(self.surface)
-        cr.set_font_face(qh.FontFace.create_for_ft_face(ft_face))
+        cr = qh.Context.create(surface)
+        cr.set_font_face(self.font_face)
         cr.set_font_size(self.body_font_size)
         cr.set_source_colour(qh.Colour.grey(0))
 
-        self.chapters = chapters
+        return cr
+
+    def get_word_recording(self, word):
+        """
+        Returns a recording surface with the word drawn at the origin, or None
+        if the drawing cache is disabled. Each word is recorded once, into a
+        recording bounded by the ink extents of the word, so that backends
+        know the size of what they replay.
+        """
+
+        if self.word_recordings is None:
+            return None
+
+        recording = self.word_recordings.get(word.text)
+        if recording is None:
+            content = qh.CAIRO.CONTENT_COLOR_ALPHA
+            cr = self.create_context(qh.RecordingSurface.create(content))
+            extents = cr.glyph_extents(word.glyphs)
+            # Leave a point around the ink for antialiasing.
+            bounds = math.ceil(extents.bounds.inset((-1, -1)))
+            recording = qh.RecordingSurface.create(content, bounds)
+            cr = self.create_context(recording)
+            cr.show_text_glyph_run(word.text_glyph_run)
+            self.word_recordings[word.text] = recording
+
+        return recording
 
     def get_text_width(self, line):
         if line >= len(self.text_widths):
@@ -90,53 +211,129 @@ class Document:
         return x
 
     def save(self):
-        lines = self._create_lines()
-        pages = self._create_pages(lines)
-
-        logger.info("Drawing pages…")
+        # Chapters are broken into lines and the lines into pages as we go,
+        # and each page is drawn as soon as it is complete and then dropped,
+        # so we only hold about a chapter’s worth of lines at any time.
+        pages = self._create_pages(self._create_lines())
         for page in pages:
-            page.draw(self.cr)
-
-        del self.cr
-        del self.surface
+            if self.filename is not None:
+                page.draw(self.cr)
+                self.cr.show_page()
+            if self.images is not None and self.images.wants(page):
+                self.images.draw(self, page)
+
+        self.word_cache.save()
+        self.break_cache.save()
+        self.manifest.save()
+
+        if self.filename is not None:
+            # Finish the surface ourselves, as references to it may remain
+            # and it must be complete before we flush the stream.
+            del self.cr
+            self.surface.finish()
+            del self.surface
+            if not isinstance(self.filename, str):
+                self.filename.flush()
 
     def _create_lines(self):
-        """Processes each chapter and creates lines for the whole document."""
+        """
+        Yields the lines of each chapter. Chapters whose input did not change
+        since the last run (with the same settings) are taken from the build
+        manifest, the rest are processed and recorded in it.
+        """
 
         logger.info("Breaking text into lines…")
 
-        lines = LineList(self)
+        key = (self.shaper.cache_key, self.text_widths, self.leading)
+        self.manifest.load(key)
+
+        changed = [c for c in self.chapters if not self.manifest.has_lines(c, self)]
+        if self.manifest.path is not None:
+            logger.info("%d of %d chapters changed", len(changed), len(self.chapters))
+
+        if self.jobs > 1:
+            processed = self._process_chapters_parallel(changed)
+        else:
+            processed = (self._process_chapter(c) for c in changed)
+
+        changed = set(c.number for c in changed)
         for chapter in self.chapters:
-            lines.extend(self._process_chapter(chapter))
+            if chapter.number in changed:
+                lines = next(processed)
+                self.manifest.add_lines(chapter, lines)
+                yield lines
+            else:
+                yield self.manifest.get_lines(chapter, self)
 
-        return lines
+    def _process_chapters_parallel(self, chapters):
+        """
+        Shapes and breaks the chapters in a pool of worker processes, yielding
+        the lines of each chapter in order. Workers send back plain tuples for
+        the lines and for any words they shaped, which we merge into our word
+        cache before rebuilding the lines.
+
+        If the document shares shaped paragraphs with the others of a batch,
+        the chapters are instead shaped here, once for all the documents, and
+        forked workers inherit them along with the shaper and the caches, only
+        breaking them into lines.
+        """
 
-    def _create_pages(self, lines):
-        """Breaks the lines into pages"""
+        settings = {"leading": self.leading, "text_widths": self.text_widths}
+        initargs = (self.page_decorations, self.cache_dir, settings)
+        context = multiprocessing
+        if self.paragraphs is not None:
+            for chapter in chapters:
+                self._shape_chapter(chapter)
+            key = (self.cache_dir, self.body_font, self.body_font_size)
+            initargs += ({key: self.resident}, self.paragraphs)
+            context = multiprocessing.get_context("fork")
+        with context.Pool(
+            self.jobs, initializer=_init_worker, initargs=initargs
+        ) as pool:
+            for lines, words, breaks in pool.imap(_process_chapter_worker, chapters):
+                for t in words:
+                    word = Word.from_tuple(t)
+                    if word.text not in self.word_cache:
+                        self.word_cache[word.text] = word
+                for key, value in breaks:
+                    if key not in self.break_cache:
+                        self.break_cache[key] = value
+                yield [node_from_tuple(self, t, NODE_KINDS) for t in lines]
+
+    def _create_pages(self, chapters):
+        """
+        Breaks the lines of each chapter, as they come, into pages and yields
+        each page once it is final. The lines after the last final page break
+        are kept and broken again with the lines of the next chapter.
+        """
 
         logger.info("Breaking lines into pages…")
 
-        pages = [Page(self, [], 1)]
-        lengths = [self.leading * self.lines_per_page]
-        breaks = lines.compute_breakpoints(lengths)
-        assert breaks[-1] == len(lines) - 1
+        yield Page(self, [], 1)
+        number = 2
 
-        start = 0
-        for i, breakpoint in enumerate(breaks[1:]):
-            ratio = lines.compute_adjustment_ratio(start, breakpoint, i, lengths)
+        lengths = [self.leading * self.lines_per_page]
+        lines = LineList(self)
+        chapters = iter(chapters)
+        done = False
+        while not done:
+            chapter = next(chapters, None)
+            if chapter is None:
+                done = True
+            else:
+                lines.extend(chapter)
 
-            page = Page(self, [], len(pages) + 1)
-            for j in range(start, breakpoint):
-                line = lines[j]
-                if line.is_glue:
-                    line.ratio = ratio
-                    line.height = line.compute_width()
-                page.lines.append(line)
+            breaks = lines.compute_breakpoints(lengths, done)
+            assert not done or not lines or breaks[-1] == len(lines) - 1
 
-            pages.append(page)
-            start = breakpoint + 1
+            start = 0
+            for first, end, ratio in lines.compute_lines(breaks, lengths):
+                ratio = min(ratio, lines.max_stretch)
+                yield Page(self, lines[first:end], number, ratio)
+                number += 1
+                start = end + 1
 
-        return pages
+            del lines[:start]
 
     def _create_heading(self, chapter):
         lines = []
@@ -152,8 +349,10 @@ class Document:
         logger.info("Chapter %d…", chapter.number)
 
         lengths = self.text_widths
-        nodes = self.shaper.shape_paragraph(chapter.text)
-        breaks = nodes.compute_breakpoints(lengths, tolerance=4, looseness=10)
+        nodes = self._shape_chapter(chapter)
+        breaks = self.break_cache.compute_breakpoints(
+            nodes, lengths, tolerance=4, looseness=10
+        )
         assert breaks[-1] == len(nodes) - 1
 
         lines = [self._create_heading(chapter)]
@@ -161,28 +360,157 @@ class Document:
             box = self.shaper.shape_word("\uFDFD")
             lines.append(Line(self, [box]))
 
-        start = 0
-        for i, breakpoint in enumerate(breaks[1:]):
-            ratio = nodes.compute_adjustment_ratio(start, breakpoint, i, lengths)
-
-            boxes = []
-            for j in range(start, breakpoint):
-                box = nodes[j]
-                if box.is_glue:
-                    box.ratio = ratio
-                    box.width = box.compute_width()
-                boxes.append(box)
-
-            lines.append(Line(self, boxes))
+        # The nodes can be shared, so they are left as they are and each line
+        # keeps the ratio to adjust its glue by.
+        for start, end, ratio in nodes.compute_lines(breaks, lengths):
+            lines.append(Line(self, nodes[start:end], ratio))
             lines.append(LineGlue(self))
 
-            start = breakpoint + 1
-
         # Allow stretching the glue between chapters.
         lines[-1].stretch = self.leading
 
         return lines
 
+    def _shape_chapter(self, chapter):
+        """
+        Shapes the chapter text, or takes it from the shared paragraphs if it
+        was already shaped for another document.
+        """
+
+        if self.paragraphs is None:
+            return self.shaper.shape_paragraph(chapter.text)
+
+        digest = chapter.get_digest()
+        if digest not in self.paragraphs:
+            self.paragraphs[digest] = self.shaper.shape_paragraph(chapter.text)
+        return self.paragraphs[digest]
+
+
+# State of worker processes used by Document._process_chapters_parallel().
+_worker_doc = None
+_worker_sent_words = set()
+
+
+def _init_worker(decorations, cache_dir, settings, resident=None, paragraphs=None):
+    global _worker_doc
+
+    _worker_doc = Document(
+        [],
+        None,
+        decorations,
+        cache_dir,
+        settings=settings,
+        resident=resident,
+        paragraphs=paragraphs,
+    )
+    if paragraphs is not None:
+        # The word cache is inherited from the parent, which has these words.
+        _worker_sent_words.update(_worker_doc.word_cache)
+
+
+def _process_chapter_worker(chapter):
+    """
+    Processes a chapter in a worker process, returning the lines as tuples
+    along with the words the parent process has not been sent yet and the
+    line breaks computed for this chapter.
+    """
+
+    doc = _worker_doc
+    # The break cache only grows, and dictionaries keep their order, so the
+    # breaks computed for this chapter come after the ones we already had.
+    known = len(doc.break_cache)
+    lines = doc._process_chapter(chapter)
+
+    words = []
+    for text in _get_words(lines):
+        if text not in _worker_sent_words:
+            _worker_sent_words.add(text)
+            words.append(doc.word_cache[text].to_tuple())
+
+    breaks = list(itertools.islice(doc.break_cache.items(), known, None))
+
+    return [node_to_tuple(line) for line in lines], words, breaks
+
+
+def _get_words(nodes):
+    """Yields the text of all the words used in the nodes, recursively."""
+
+    for node in nodes:
+        if isinstance(node, Line):
+            yield from _get_words(node.boxes)
+        elif isinstance(node, Box):
+            yield node.word.text
+
+
+class PageImages:
+    """
+    Class drawing selected pages of a document to PNG images, at the given
+    resolution. Each page can also be cut into square tiles, and get a
+    thumbnail of the given width. The image of page N is written to dirname
+    as “page-NNN.png”, its tiles as “page-NNN-ROW-COLUMN.png” and its
+    thumbnail as “page-NNN-thumbnail.png”.
+    """
+
+    def __init__(self, dirname, pages=None, dpi=96, tile_size=0, thumbnail=0):
+        self.dirname = dirname
+        self.pages = pages
+        self.dpi = dpi
+        self.tile_size = tile_size
+        self.thumbnail = thumbnail
+
+    def wants(self, page):
+        return self.pages is None or page.number in self.pages
+
+    def draw(self, doc, page):
+        scale = self.dpi / qh.base_dpi
+        width = math.ceil(doc.page_width * scale)
+        height = math.ceil(doc.page_height * scale)
+
+        surface = qh.ImageSurface.create(qh.CAIRO.FORMAT_RGB24, (width, height))
+        cr = doc.create_context(surface)
+        cr.save()
+        cr.set_source_colour(qh.Colour.grey(1))
+        cr.paint()
+        cr.restore()
+        cr.scale((scale, scale))
+        page.draw(cr)
+        surface.flush()
+
+        os.makedirs(self.dirname, exist_ok=True)
+        name = os.path.join(self.dirname, "page-%03d" % page.number)
+        surface.write_to_png(name + ".png")
+
+        if self.tile_size:
+            size = self.tile_size
+            for row, y in enumerate(range(0, height, size)):
+                for column, x in enumerate(range(0, width, size)):
+                    tile = self._copy(surface, qh.Rect(x, y, size, size), 1)
+                    tile.write_to_png("%s-%d-%d.png" % (name, row, column))
+
+        if self.thumbnail:
+            thumbnail = self._copy(
+                surface, qh.Rect(0, 0, width, height), self.thumbnail / width
+            )
+            thumbnail.write_to_png(name + "-thumbnail.png")
+
+    @staticmethod
+    def _copy(surface, rect, scale):
+        """Copies the rect part of the image surface scaled to a new one."""
+
+        width = min(rect.width, surface.width - rect.left)
+        height = min(rect.height, surface.height - rect.top)
+        result = qh.ImageSurface.create(
+            qh.CAIRO.FORMAT_RGB24,
+            (math.ceil(width * scale), math.ceil(height * scale)),
+        )
+        cr = qh.Context.create(result)
+        cr.scale((scale, scale))
+        cr.set_source_surface(surface, (-rect.left, -rect.top))
+        cr.paint()
+        result.flush()
+
+        return result
+
 
 class Chapter:
     """Class holding input text and metadata for a chapter."""
@@ -195,6 +523,22 @@ class Chapter:
         self.opening = opening
         self.verses = verses
 
+    def get_digest(self):
+        """
+        Returns a digest of the chapter input, its text and metadata. Quarter
+        numbers are already part of the text, so a chapter also changes when
+        quarters are added or removed before it.
+        """
+        data = (
+            self.text,
+            self.number,
+            self.name,
+            self.place,
+            self.opening,
+            self.verses,
+        )
+        return hashlib.sha256(repr(data).encode("utf-8")).hexdigest()
+
     def get_heading_text(self):
         text = []
         number = format_number(self.number)
@@ -215,9 +559,27 @@ class Shaper:
         self.font = hb.Font.ft_create(ft_face)
         self.buffer = hb.Buffer.create()
 
+        self.cache_key = self.get_cache_key(ft_face)
+        doc.word_cache.load(self.cache_key)
+
         # Get the natural space width
         self.space = self.shape_word(" ").width
 
+    def get_cache_key(self, ft_face):
+        """
+        Returns a tuple identifying everything that affects the shaping
+        results, used to key the persistent word cache. The buffer direction
+        is derived from the word text itself, so it is not part of the key.
+        """
+        return (
+            file_digest(ft_face.filename),
+            self.doc.body_font_size,
+            hb.version_string(),
+            BUFFER_SCRIPT,
+            BUFFER_LANGUAGE,
+            BUFFER_CLUSTER_LEVEL,
+        )
+
     def shape_word(self, word):
         """
         Shapes a single word and returns the corresponding box. To speed things
@@ -241,15 +603,13 @@ class Shaper:
                 self.buffer.direction = hb.HARFBUZZ.DIRECTION_LTR
             else:
                 self.buffer.direction = hb.HARFBUZZ.DIRECTION_RTL
-            self.buffer.script = hb.HARFBUZZ.SCRIPT_ARABIC
-            self.buffer.language = hb.Language.from_string("ar")
-            self.buffer.cluster_level = (
-                hb.HARFBUZZ.BUFFER_CLUSTER_LEVEL_MONOTONE_CHARACTERS
-            )
+            self.buffer.script = BUFFER_SCRIPT
+            self.buffer.language = hb.Language.from_string(BUFFER_LANGUAGE)
+            self.buffer.cluster_level = BUFFER_CLUSTER_LEVEL
 
             hb.shape(self.font, self.buffer)
 
-            self.doc.word_cache[text] = Word(text, self.buffer)
+            self.doc.word_cache[text] = Word.from_buffer(text, self.buffer)
 
         box = Box(self.doc, self.doc.word_cache[text])
 
@@ -298,11 +658,25 @@ class Shaper:
                 word += ch
         nodes.append(self.shape_word(word))  # last word
 
-        nodes.add_closing_penalty()
+        # The closing glue and penalties of NodeList.add_closing_penalty(), as
+        # our own nodes.
+        nodes.append(Penalty(self.doc, 0, linebreak.INFINITY))
+        nodes.append(Glue(self.doc, 0, linebreak.INFINITY, 0))
+        nodes.append(Penalty(self.doc, 0, -linebreak.INFINITY, 1))
 
         return nodes
 
 
+def file_digest(path):
+    """Returns the SHA-256 hex digest of the file contents."""
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def format_number(number):
     """Format number to Arabic-Indic digits."""
 
@@ -313,20 +687,20 @@ def format_number(number):
 class Page:
     """Class representing a page of text."""
 
-    def __init__(self, doc, lines, number):
+    def __init__(self, doc, lines, number, ratio=None):
         self.doc = doc
         self.lines = lines
         self.number = number
+        # Adjustment ratio of the glue between the lines.
+        self.ratio = ratio
 
     def draw(self, cr):
         logger.info("Page %d…", self.number)
 
         shaper = self.doc.shaper
-        self.cr = cr
 
         if not self.lines:
             logger.debug("Leaving empty page blank")
-            cr.show_page()
             return
 
         self.strip()
@@ -339,9 +713,12 @@ class Page:
             line.draw(cr, pos, text_width)
             if line.get_quarter() or line.get_prostration():
                 self._show_quarter(
-                    line, line.get_quarter(), line.get_prostration(), pos.y
+                    cr, line, line.get_quarter(), line.get_prostration(), pos.y
                 )
-            pos.y += line.height
+            if line.is_glue:
+                pos.y += line.compute_width(self.ratio)
+            else:
+                pos.y += line.height
 
         # Show page number.
         box = shaper.shape_word(format_number(self.number))
@@ -366,9 +743,7 @@ class Page:
             cr.stroke()
             cr.restore()
 
-        cr.show_page()
-
-    def _show_quarter(self, line, quarter, prostration, y):
+    def _show_quarter(self, cr, line, quarter, prostration, y):
         """
         Draw the quarter, group and part text on the margin. A group is 4
         quarters, a part is 2 groups.
@@ -419,11 +794,11 @@ class Page:
             # Center the box horizontally relative to the others
             offset = (w - box.width) * scale / 2
 
-            self.cr.save()
-            self.cr.translate((x + offset, y))
-            self.cr.scale((scale, scale))
-            self.cr.show_glyphs(box.word.glyphs)
-            self.cr.restore()
+            cr.save()
+            cr.translate((x + offset, y))
+            cr.scale((scale, scale))
+            cr.show_glyphs(box.word.glyph_run)
+            cr.restore()
 
             y += leading
 
@@ -435,19 +810,36 @@ class Page:
 class Word:
     """Class representing a shaped word."""
 
-    def __init__(self, text, buf):
+    def __init__(self, text, glyphs, width, backward=False, clusters=None):
         self.text = text
+        self.glyphs = glyphs
+        self.width = width
+        self.backward = backward
+        if clusters is None:
+            clusters = [(len(text), len(glyphs))]
+        self.clusters = clusters
+
+        # Glyphs, text and clusters converted once to Cairo form, as each
+        # word is drawn many times.
+        if backward:
+            flags = qh.CAIRO.TEXT_CLUSTER_FLAG_BACKWARD
+        else:
+            flags = 0
+        self.glyph_run = qh.GlyphRun(glyphs)
+        self.text_glyph_run = qh.TextGlyphRun(text, self.glyph_run, clusters, flags)
+
+    @classmethod
+    def from_buffer(cls, text, buf):
+        """Creates a word from a shaped HarfBuzz buffer."""
 
         glyphs, pos = buf.get_glyphs()
-        self.glyphs = glyphs
-        self.width = pos.x
 
         if False:
             # Do clusters per glyph/charcter, disabled for now as it does not
             # seem to improve things that much.
-            self.backward = hb.HARFBUZZ.DIRECTION_IS_BACKWARD(buf.direction)
+            backward = hb.HARFBUZZ.DIRECTION_IS_BACKWARD(buf.direction)
             infos = buf.glyph_infos
-            if self.backward:
+            if backward:
                 infos = infos[::-1]
 
             clusters = []
@@ -468,61 +860,387 @@ class Word:
                 n_chars = next_cluster - info.cluster
 
                 clusters.append((n_chars, n_glyphs))
-            self.clusters = clusters
         else:
-            self.backward = False
-            self.clusters = [(len(text), len(glyphs))]
+            backward = False
+            clusters = None
+
+        return cls(text, glyphs, pos.x, backward, clusters)
+
+    def to_tuple(self):
+        """Returns a plain, picklable representation of the word."""
+
+        glyphs = tuple((g.index, g.pos.x, g.pos.y) for g in self.glyphs)
+        return (self.text, glyphs, self.width, self.backward, tuple(self.clusters))
+
+    @classmethod
+    def from_tuple(cls, t):
+        """Creates a word from the output of to_tuple()."""
+
+        text, glyphs, width, backward, clusters = t
+        glyphs = [qh.Glyph(index, (x, y)) for index, x, y in glyphs]
+        return cls(text, glyphs, width, backward, list(clusters))
+
+
+class WordCache(dict):
+    """
+    Cache of shaped words, keyed by word text. If a cache directory is given,
+    the cache is loaded from and saved to a file whose name is derived from
+    the shaper’s cache key, so that changing the font, its size or the
+    HarfBuzz version never reuses stale entries.
+    """
+
+    # Bump this when the stored word format changes.
+    version = 1
+
+    def __init__(self, cache_dir=None):
+        super().__init__()
+        self.cache_dir = cache_dir
+        self.path = None
+        self.dirty = False
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.dirty = True
+
+    def load(self, key):
+        if self.cache_dir is None:
+            return
+
+        self.path = cache_path(self.cache_dir, "words", self.version, key)
+        words = load_pickle(self.path, "word cache")
+        if words is None:
+            return
+
+        for t in words:
+            word = Word.from_tuple(t)
+            super().__setitem__(word.text, word)
+
+        logger.info("Loaded %d words from cache: %s", len(words), self.path)
+
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+
+        logger.info("Saving %d words to cache: %s", len(self), self.path)
+        save_pickle(self.path, [word.to_tuple() for word in self.values()])
+
+        self.dirty = False
+
+
+class BreakCache(dict):
+    """
+    Cache of line breaks, keyed by a digest of the shaped paragraph and of
+    the line breaking arguments, so that paragraphs whose shaping did not
+    change are not broken again, even with other layout settings. Persisted
+    to the cache directory like the word cache.
+    """
+
+    # Bump this when the stored breaks format changes.
+    version = 1
+
+    def __init__(self, cache_dir=None):
+        super().__init__()
+        self.cache_dir = cache_dir
+        self.path = None
+        self.dirty = False
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.dirty = True
+
+    def load(self, key):
+        if self.cache_dir is None or self.path is not None:
+            return
+
+        self.path = cache_path(self.cache_dir, "breaks", self.version, key)
+        breaks = load_pickle(self.path, "break cache")
+        if breaks is None:
+            return
+
+        self.update(breaks)
+        logger.info("Loaded %d line breaks from cache: %s", len(breaks), self.path)
+
+    def compute_breakpoints(self, nodes, line_lengths, **kwargs):
+        """
+        Returns nodes.compute_breakpoints(line_lengths, **kwargs), computing
+        it only if the same nodes were not broken the same way before.
+        """
+
+        key = (nodes.compute_fingerprint(), tuple(line_lengths), sorted(kwargs.items()))
+        key = hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+        breaks = self.get(key)
+        if breaks is None:
+            breaks = tuple(nodes.compute_breakpoints(line_lengths, **kwargs))
+            self[key] = breaks
+        else:
+            # NodeList.compute_lines() needs the running sums.
+            nodes.compute_sums()
+
+        return list(breaks)
+
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+
+        logger.info("Saving %d line breaks to cache: %s", len(self), self.path)
+        save_pickle(self.path, dict(self))
+
+        self.dirty = False
+
+
+class BuildManifest:
+    """
+    Lines of processed chapters, keyed by chapter number and recorded along
+    with a digest of the chapter input, so that a rebuild only needs to shape
+    and break the chapters that changed. Like the word cache, it is saved in
+    the cache directory to a file whose name is derived from everything else
+    the lines depend on. The lines reference words by text, so the entries
+    are only good as long as the word cache has these words.
+    """
+
+    # Bump this when the stored line format changes.
+    version = 3
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.path = None
+        self.dirty = False
+        self.chapters = {}
+
+    def load(self, key):
+        if self.cache_dir is None:
+            return
+
+        self.path = cache_path(self.cache_dir, "manifest", self.version, key)
+        self.chapters = {}
+        chapters = load_pickle(self.path, "build manifest")
+        if chapters is None:
+            return
+
+        self.chapters = chapters
+
+        logger.info(
+            "Loaded %d chapters from manifest: %s", len(self.chapters), self.path
+        )
+
+    def has_lines(self, chapter, doc):
+        """
+        Returns whether we have lines for the chapter as it is now, and all
+        the words they use.
+        """
+        entry = self.chapters.get(chapter.number)
+        if entry is None or entry[0] != chapter.get_digest():
+            return False
+        return all(text in doc.word_cache for text in entry[2])
+
+    def get_lines(self, chapter, doc):
+        _, lines, _ = self.chapters[chapter.number]
+        return [node_from_tuple(doc, t, NODE_KINDS) for t in lines]
+
+    def add_lines(self, chapter, lines):
+        if self.path is None:
+            return
+
+        words = set(_get_words(lines))
+        lines = [node_to_tuple(line) for line in lines]
+        self.chapters[chapter.number] = (chapter.get_digest(), lines, words)
+        self.dirty = True
+
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+
+        logger.info("Saving %d chapters to manifest: %s", len(self.chapters), self.path)
+        save_pickle(self.path, self.chapters)
+
+        self.dirty = False
 
 
 class LineList(linebreak.NodeList):
+    """
+    Class representing the lines of the document, broken into pages by
+    compute_breakpoints(). Lines and headings are boxes, the glue between
+    them is where pages can break.
+    """
+
+    # Page breaking costs. A page costs 100 × r³ for stretching its glue by
+    # a ratio r of at most max_stretch, plus empty_line_demerits for each line
+    # of space left empty at its bottom, squared. Leaving a chapter heading at
+    # the bottom of a page with fewer than heading_lines lines after it costs
+    # widowed_heading_demerits. Costs are rounded to whole demerits, as in
+    # TeX, so that paths add up exactly.
+    max_stretch = 1
+    empty_line_demerits = 100
+    widowed_heading_demerits = 10000
+    heading_lines = 2
+
     def __init__(self, doc):
         super().__init__()
         self.doc = doc
 
-    def compute_breakpoints(self, line_lengths):
-        # Copied from compute_breakpoints() since compute_adjustment_ratio()
-        # needs them.
-        self.sum_width = {}
-        self.sum_shrink = {}
-        self.sum_stretch = {}
-        width_sum = shrink_sum = stretch_sum = 0
-        for i, node in enumerate(self):
-            self.sum_width[i] = width_sum
-            self.sum_shrink[i] = shrink_sum
-            self.sum_stretch[i] = stretch_sum
-
-            width_sum += node.height
-            shrink_sum += node.shrink
-            stretch_sum += node.stretch
-
-        # Calculate line breaks.
-        # XXX: This seems rather hackish, clean it up!
-        breaks = [0]
-        height = 0
-        last = 0
-        i = 0
-        while i < len(self):
-            line = len(breaks)
-            length = line_lengths[line if line < len(line_lengths) else -1]
+    def to_units(self, height):
+        """
+        Returns height in thousandths of a line. Heights in these units add
+        up exactly: a full page must not come out a hair too long, and the
+        same lines must measure the same however many lines come before
+        them, for streamed and one-shot breaking to agree.
+        """
+
+        return round(height * 1000 / self.doc.leading)
+
+    def compute_sums(self):
+        """
+        Precomputes the running sums of height, stretch and shrink, in the
+        units of to_units().
+        """
 
-            node = self[i]
-            if node.is_box or node.is_glue:
-                height += node.height
+        scale = 1000 / self.doc.leading
+        self.sum_width = sum_height = [0]
+        self.sum_stretch = sum_stretch = [0]
+        self.sum_shrink = sum_shrink = [0]
+        height = stretch = shrink = 0
+        for node in self:
+            height += round(node.height * scale)
+            stretch += round(node.stretch * scale)
+            shrink += round(node.shrink * scale)
+            sum_height.append(height)
+            sum_stretch.append(stretch)
+            sum_shrink.append(shrink)
+
+    def compute_lines(self, breakpoints, line_lengths):
+        line_lengths = [self.to_units(length) for length in line_lengths]
+        return super().compute_lines(breakpoints, line_lengths)
+
+    def compute_breakpoints(self, line_lengths, final=True):
+        """
+        Returns the optimal page breaks, the ones with the least total cost,
+        as a list of indices starting with 0 (the start of the first page)
+        and ending with the last node. Just [0] means there are no pages.
+
+        Pages get shorter as they get more costly, so for each possible break
+        we only need to look back at the breaks at most a page before it, and
+        the time is linear in the number of lines.
+
+        If final is false, more lines are still to come, and the best breaks
+        for the lines we have so far may change. Only the breaks that the
+        best breaks of all possible starts of the next page agree on are
+        final; we return those.
+        """
+
+        # compute_lines() needs the running sums too.
+        self.compute_sums()
+
+        n = len(self)
+        if n == 0:
+            # No lines, no pages.
+            return [0]
+
+        line_lengths = [self.to_units(length) for length in line_lengths]
+        sum_height = self.sum_width
+        sum_stretch = self.sum_stretch
+        sum_shrink = self.sum_shrink
+
+        # For each node, the index of the last heading up to it, and the
+        # number of lines up to it.
+        headings = []
+        line_counts = [0]
+        heading = None
+        for i, node in enumerate(self):
+            if isinstance(node, Heading):
+                heading = i
+            headings.append(heading)
+            line_counts.append(line_counts[-1] + isinstance(node, Line))
+
+        # Break -1 stands for the start of the first page, and the last node
+        # is always a break.
+        candidates = [-1] + [i for i in range(n - 1) if not self[i].is_box]
+        candidates.append(n - 1)
+
+        # The least demerits to break at each candidate, the candidate before
+        # it on that path, and the number of pages up to it.
+        m = len(candidates)
+        demerits = [None] * m
+        previous = [None] * m
+        pages = [0] * m
+        demerits[0] = 0
+        for k in range(1, m):
+            b = candidates[k]
+            last = final and b == n - 1
+
+            # A heading this page must not end close after.
+            widowed = None
+            heading = headings[b - 1] if b > 0 else None
+            if (
+                not last
+                and heading is not None
+                and not self[b].stretch
+                and line_counts[b] - line_counts[heading] < self.heading_lines
+            ):
+                widowed = heading
+
+            for j in range(k - 1, -1, -1):
+                start = candidates[j] + 1
+                page = pages[j]
+                length = line_lengths[page if page < len(line_lengths) else -1]
+                height = sum_height[b] - sum_height[start]
+                shrink = sum_shrink[b] - sum_shrink[start]
+                if height - shrink > length:
+                    # Too many lines, and it only gets worse going back.
+                    break
+                if demerits[j] is None:
+                    # No feasible way to get here.
+                    continue
 
-            if not node.is_box:
                 if height > length:
-                    breaks.append(last)
-                    height = 0
-                    i = last
-                elif height == length:
-                    breaks.append(i)
-                    height = 0
+                    cost = 100 * ((height - length) / shrink) ** 3
                 else:
-                    last = i
-            i += 1
-
-        if breaks[-1] != len(self) - 1:
-            breaks.append(len(self) - 1)
+                    stretch = sum_stretch[b] - sum_stretch[start]
+                    used = min(length - height, stretch * self.max_stretch)
+                    cost = 0
+                    if used:
+                        cost = 100 * (used / stretch) ** 3
+                    if not last:
+                        empty = (length - height - used) / 1000
+                        cost += self.empty_line_demerits * empty**2
+                cost = round(cost)
+                if widowed is not None and widowed >= start:
+                    cost += self.widowed_heading_demerits
+
+                total = demerits[j] + cost
+                if demerits[k] is None or total < demerits[k]:
+                    demerits[k] = total
+                    previous[k] = j
+                    pages[k] = page + 1
+
+        if final:
+            end = m - 1
+        else:
+            # Any break less than a page before the end can start the next
+            # page, the breaks before their common ancestor are final.
+            length = line_lengths[-1]
+            common = None
+            for k in range(m):
+                b = candidates[k]
+                if demerits[k] is None or sum_height[n] - sum_height[b + 1] > length:
+                    continue
+                ancestors = set()
+                while k is not None:
+                    ancestors.add(k)
+                    k = previous[k]
+                common = ancestors if common is None else common & ancestors
+            if common is None:
+                # No way to break the lines we have yet, wait for more.
+                return [0]
+            end = max(common)
+
+        breaks = []
+        k = end
+        while k:
+            breaks.append(candidates[k])
+            k = previous[k]
+        breaks.append(0)
+        breaks.reverse()
 
         # Check that we are not overflowing the page, i.e. we don’t have more
         # lines per page (plus intervening glue) than we should.
@@ -537,10 +1255,19 @@ class LineList(linebreak.NodeList):
 class Glue(linebreak.Glue):
     """Wrapper around linebreak.Glue to hold our common API."""
 
+    kind = "glue"
+
     def __init__(self, doc, width, stretch, shrink):
         super().__init__(width=width, stretch=stretch, shrink=shrink)
         self.doc = doc
 
+    def to_tuple(self):
+        return (self.width, self.stretch, self.shrink)
+
+    @classmethod
+    def from_tuple(cls, doc, t):
+        return cls(doc, *t)
+
     def draw(self, cr, pos, text_width=0):
         pass
 
@@ -554,10 +1281,19 @@ class Glue(linebreak.Glue):
 class Penalty(linebreak.Penalty):
     """Wrapper around linebreak.Penalty to hold our common API."""
 
+    kind = "penalty"
+
     def __init__(self, doc, width, penalty, flagged=0):
         super().__init__(width=width, penalty=penalty, flagged=flagged)
         self.doc = doc
 
+    def to_tuple(self):
+        return (self.width, self.penalty, self.flagged)
+
+    @classmethod
+    def from_tuple(cls, doc, t):
+        return cls(doc, *t)
+
     def draw(self, cr, pos, text_width=0):
         pass
 
@@ -571,6 +1307,8 @@ class Penalty(linebreak.Penalty):
 class Box(linebreak.Box):
     """Class representing a word."""
 
+    kind = "box"
+
     def __init__(self, doc, word):
         super().__init__(width=word.width)
         self.doc = doc
@@ -578,6 +1316,18 @@ class Box(linebreak.Box):
         self.quarter = 0
         self.prostration = False
 
+    def to_tuple(self):
+        """Returns the fields for node_to_tuple(), referencing the word by text."""
+        return (self.word.text, self.quarter, self.prostration)
+
+    @classmethod
+    def from_tuple(cls, doc, t):
+        text, quarter, prostration = t
+        node = cls(doc, doc.word_cache[text])
+        node.quarter = quarter
+        node.prostration = prostration
+        return node
+
     def get_quarter(self):
         return self.quarter
 
@@ -585,18 +1335,20 @@ class Box(linebreak.Box):
         return self.prostration
 
     def draw(self, cr, pos, text_width=0):
+        recording = self.doc.get_word_recording(self.word)
         cr.save()
-        cr.translate(pos)
-        word = self.word
-        if word.backward:
-            flags = qh.CAIRO.TEXT_CLUSTER_FLAG_BACKWARD
+        if recording is not None:
+            cr.set_source_surface(recording, pos)
+            cr.paint()
         else:
-            flags = 0
-        cr.show_text_glyphs(word.text, word.glyphs, word.clusters, flags)
+            cr.translate(pos)
+            cr.show_text_glyph_run(self.word.text_glyph_run)
         cr.restore()
 
 
 class LineGlue(Glue):
+    kind = "lineglue"
+
     def __init__(self, doc, height=0, stretch=0, shrink=0):
         super().__init__(doc, width=height, stretch=stretch, shrink=shrink)
         self.height = self.width
@@ -605,11 +1357,23 @@ class LineGlue(Glue):
 class Line(linebreak.Box):
     """Class representing a line of text."""
 
-    def __init__(self, doc, boxes):
+    kind = "line"
+
+    def __init__(self, doc, boxes, ratio=None):
         super().__init__(width=doc.leading)
         self.doc = doc
         self.height = self.width
         self.boxes = boxes
+        # Adjustment ratio of the glue between the boxes.
+        self.ratio = ratio
+
+    def to_tuple(self):
+        return ([node_to_tuple(box) for box in self.boxes], self.ratio)
+
+    @classmethod
+    def from_tuple(cls, doc, t):
+        boxes, ratio = t
+        return cls(doc, [node_from_tuple(doc, b, NODE_KINDS) for b in boxes], ratio)
 
     def get_quarter(self):
         for box in self.boxes:
@@ -625,16 +1389,17 @@ class Line(linebreak.Box):
 
     def draw(self, cr, pos, text_width):
         self.strip()
-        width = sum([box.width for box in self.boxes])
+        widths = [box.compute_width(self.ratio) for box in self.boxes]
+        width = sum(widths)
         # Center lines not equal to text width.
         if not math.isclose(width, text_width):
             pos.x -= (text_width - width) / 2
 
-        for box in self.boxes:
+        for box, box_width in zip(self.boxes, widths):
             # We start drawing from the right edge of the text block,
             # and move to the left, thus the subtraction instead of
             # addition below.
-            pos.x -= box.width
+            pos.x -= box_width
             box.draw(cr, pos)
 
     def strip(self):
@@ -645,10 +1410,20 @@ class Line(linebreak.Box):
 class Heading(Line):
     """Class representing a chapter heading."""
 
+    kind = "heading"
+
     def __init__(self, doc, lines):
         super().__init__(doc, lines)
         self.height = doc.leading * 1.8
 
+    def to_tuple(self):
+        return ([node_to_tuple(line) for line in self.boxes],)
+
+    @classmethod
+    def from_tuple(cls, doc, t):
+        (lines,) = t
+        return cls(doc, [node_from_tuple(doc, l, NODE_KINDS) for l in lines])
+
     def draw(self, cr, pos, width):
         offset = self.doc.leading / 2
         height = self.height - offset
@@ -667,6 +1442,10 @@ class Heading(Line):
         cr.restore()
 
 
+# Node classes by kind, for node_from_tuple().
+NODE_KINDS = {cls.kind: cls for cls in (Box, Glue, Penalty, LineGlue, Line, Heading)}
+
+
 def read_data(datadir):
     path = os.path.join(datadir, "meta.txt")
     if os.path.isfile(path):
@@ -708,21 +1487,186 @@ def read_data(datadir):
     return chapters
 
 
-def main(chapters, filename, decorations):
-    document = Document(chapters, filename, decorations)
+# Settings a server request can change, see serve().
+LAYOUT_SETTINGS = (
+    "lines_per_page",
+    "leading",
+    "text_widths",
+    "page_width",
+    "page_height",
+    "top_margin",
+    "outer_margin",
+    "page_number_ypos",
+)
+
+
+def check_settings(settings):
+    """Raises ValueError if settings has anything but LAYOUT_SETTINGS."""
+
+    for name in settings:
+        if name not in LAYOUT_SETTINGS:
+            raise ValueError("Unknown setting: %s" % name)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Handles a server request, see serve()."""
+
+    def handle(self):
+        start = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.readline())
+            self.server.typeset(request)
+        except Exception as e:
+            logger.exception("Request failed")
+            response = {"ok": False, "error": str(e)}
+        else:
+            response = {"ok": True, "time": time.perf_counter() - start}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class Server(socketserver.UnixStreamServer):
+    """
+    Server typesetting documents on request, keeping the shapers, word caches
+    and fonts of earlier requests. Requests are handled one at a time.
+    """
+
+    def __init__(self, path):
+        remove_stale_socket(path)
+        super().__init__(path, RequestHandler)
+        self.resident = {}
+
+    def typeset(self, request):
+        settings = request.get("settings", {})
+        check_settings(settings)
+
+        all_chapters = read_data(request["datadir"])
+        if all_chapters is None:
+            raise ValueError("Can’t read data: %s" % request["datadir"])
+        numbers = request.get("chapters", range(1, 115))
+        chapters = [all_chapters[i - 1] for i in numbers]
+
+        images = None
+        if "png" in request:
+            png = dict(request["png"])
+            if png.get("pages") is not None:
+                png["pages"] = set(png["pages"])
+            images = PageImages(**png)
+
+        document = Document(
+            chapters,
+            request.get("outfile"),
+            request.get("decorations", True),
+            request.get("cache_dir"),
+            request.get("jobs", 1),
+            request.get("draw_cache", False),
+            images,
+            settings,
+            self.resident,
+        )
+        document.save()
+
+
+def remove_stale_socket(path):
+    """
+    Removes the socket at path if it is left from a server that did not exit
+    cleanly, i.e. nothing is listening on it. Anything else at path is left
+    alone, for binding to fail.
+    """
+
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            logger.info("Removing stale socket: %s", path)
+            os.unlink(path)
+
+
+def serve(path):
+    """
+    Runs a server listening on a Unix socket at path. Each connection sends
+    one request, a line of JSON with the arguments of a typesetter run, and
+    gets back one line of JSON, {"ok": true, "time": SECONDS} or {"ok": false,
+    "error": MESSAGE}. Request keys, all optional but datadir:
+
+        datadir, outfile, chapters, decorations, cache_dir, jobs, draw_cache:
+            As the command line arguments.
+        png: Keyword arguments for PageImages.
+        settings: Layout settings to change, see LAYOUT_SETTINGS.
+
+    Paths are relative to the working directory of the server. For example:
+
+        echo '{"datadir": "/data", "outfile": "/tmp/out.pdf", "chapters": [1]}' \\
+            | socat - UNIX-CONNECT:typesetter.sock
+    """
+
+    with Server(path) as server:
+        logger.info("Listening on %s", path)
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+def typeset_batch(
+    chapters, layouts, decorations=True, cache_dir=None, jobs=1, draw_cache=False
+):
+    """
+    Typesets the chapters once for each of the layouts, a list of (filename,
+    settings) pairs with settings as in serve(). The chapters are shaped only
+    once; the documents share the shaped text, as well as the shaper and the
+    fonts, and only break it into lines and pages and draw it each in their
+    own layout, also when breaking in worker processes (jobs > 1).
+    """
+
+    for filename, settings in layouts:
+        check_settings(settings)
+
+    resident = {}
+    paragraphs = {}
+    for filename, settings in layouts:
+        document = Document(
+            chapters,
+            filename,
+            decorations,
+            cache_dir,
+            jobs,
+            draw_cache,
+            settings=settings,
+            resident=resident,
+            paragraphs=paragraphs,
+        )
+        document.save()
+
+
+def main(
+    chapters, filename, decorations, cache_dir, jobs, draw_cache=False, images=None
+):
+    document = Document(
+        chapters, filename, decorations, cache_dir, jobs, draw_cache, images
+    )
     document.save()
 
 
 if __name__ == "__main__":
     import argparse
-    import os
     import sys
 
     parser = argparse.ArgumentParser(description="Quran Typesetter.")
     parser.add_argument(
-        "datadir", metavar="DATADIR", help="Directory containing input files to process"
+        "datadir",
+        metavar="DATADIR",
+        nargs="?",
+        help="Directory containing input files to process",
+    )
+    parser.add_argument(
+        "outfile", metavar="OUTFILE", nargs="?", help="Output PDF file, - for stdout"
     )
-    parser.add_argument("outfile", metavar="OUTFILE", help="Output file")
     parser.add_argument(
         "--chapters",
         "-c",
@@ -740,6 +1684,64 @@ if __name__ == "__main__":
         dest="decorations",
         help="Don’t draw page decorations",
     )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Directory for caching shaped words, line breaks and lines",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        metavar="N",
+        type=int,
+        default=1,
+        help="Number of processes for shaping and line breaking (Default: 1)",
+    )
+    parser.add_argument(
+        "--draw-cache",
+        action="store_true",
+        help="Draw each distinct word once and reuse the drawing",
+    )
+    parser.add_argument(
+        "--png",
+        metavar="DIR",
+        help="Directory to draw page images to, with or without OUTFILE",
+    )
+    parser.add_argument(
+        "--pages",
+        "-p",
+        metavar="N",
+        nargs="*",
+        type=int,
+        help="Which pages to draw images of (Default: all)",
+    )
+    parser.add_argument(
+        "--dpi", metavar="N", type=float, default=96, help="Image resolution"
+    )
+    parser.add_argument(
+        "--tile-size",
+        metavar="PX",
+        type=int,
+        default=0,
+        help="Also cut page images into square tiles of this size",
+    )
+    parser.add_argument(
+        "--thumbnail-width",
+        metavar="PX",
+        type=int,
+        default=0,
+        help="Also draw page thumbnails of this width",
+    )
+    parser.add_argument(
+        "--layouts",
+        metavar="FILE",
+        help="JSON list of {outfile, settings} layouts to typeset instead of OUTFILE",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help="Typeset documents on requests to a Unix socket, keeping fonts loaded",
+    )
     parser.add_argument(
         "--quite", "-q", action="store_true", help="Don’t print normal messages"
     )
@@ -748,12 +1750,24 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
+    if args.serve is None:
+        if args.datadir is None:
+            parser.error("DATADIR is required")
+        if args.layouts is not None:
+            if args.outfile is not None or args.png is not None:
+                parser.error("--layouts can’t be used with OUTFILE or --png")
+        elif args.outfile is None and args.png is None:
+            parser.error("either OUTFILE or --png is required")
 
     if args.verbose:
         logger.setLevel(logging.DEBUG)
     if args.quite:
         logger.setLevel(logging.ERROR)
 
+    if args.serve is not None:
+        serve(args.serve)
+        sys.exit(0)
+
     all_chapters = read_data(args.datadir)
     if all_chapters is None:
         sys.exit(1)
@@ -762,4 +1776,36 @@ if __name__ == "__main__":
     for i in args.chapters:
         chapters.append(all_chapters[i - 1])
 
-    main(chapters, args.outfile, args.decorations)
+    if args.layouts is not None:
+        with open(args.layouts, "r", encoding="utf-8") as f:
+            layouts = [(l["outfile"], l.get("settings", {})) for l in json.load(f)]
+        typeset_batch(
+            chapters,
+            layouts,
+            args.decorations,
+            args.cache_dir,
+            args.jobs,
+            args.draw_cache,
+        )
+        sys.exit(0)
+
+    images = None
+    if args.png is not None:
+        pages = None if args.pages is None else set(args.pages)
+        images = PageImages(
+            args.png, pages, args.dpi, args.tile_size, args.thumbnail_width
+        )
+
+    outfile = args.outfile
+    if outfile == "-":
+        outfile = sys.stdout.buffer
+
+    main(
+        chapters,
+        outfile,
+        args.decorations,
+        args.cache_dir,
+        args.jobs,
+        args.draw_cache,
+        images,
+    )
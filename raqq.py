@@ -1,14 +1,29 @@
+import hashlib
+import json
 import logging
 import math
+import multiprocessing
 import os
+import socket
+import socketserver
+import stat
+import tempfile
+import time
 import unicodedata
+from collections import OrderedDict
 
 import harfbuzz as hb
 import qahirah as qh
 
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
 import linebreak
 
 from number import format_number
+from persist import cache_path, load_pickle, node_from_tuple, node_to_tuple, save_pickle
 
 ft = qh.get_ft_lib()
 
@@ -29,7 +44,9 @@ class Document:
     """Class representing the main document and holding document-wide settings
     and state."""
 
-    def __init__(self, chapters, filename, debug):
+    def __init__(
+        self, chapters, filename, debug, cache_dir=None, jobs=1, resident=None
+    ):
         logger.info("Initializing the document: %s", filename)
 
         self.debug = debug
@@ -48,29 +65,99 @@ class Document:
 
         self.text_start_pos = self.text_width + (self.page_width - self.text_width) / 2
 
-        self.shaper = Shaper(self)
+        # Cache for shaped verses, persisted to cache_dir if one is given.
+        # resident, if given, is a dictionary that outlives the document, and
+        # keeps the verse cache and the shaper, with its font data and fonts,
+        # for later documents using the same cache_dir and font.
+        if resident is None:
+            resident = {}
+        key = (cache_dir, self.body_font, self.body_font_size)
+        if key not in resident:
+            resident[key] = {"verse_cache": VerseCache(cache_dir)}
+        self.resident = resident[key]
+        self.verse_cache = self.resident["verse_cache"]
+        if "shaper" not in self.resident:
+            self.resident["shaper"] = Shaper(self)
+        self.shaper = self.resident["shaper"]
+        self.shaper.doc = self
+
+        # Number of worker processes for drawing pages. Each one draws its
+        # pages to separate PDF files, which we then merge using pypdf.
+        if jobs > 1 and pypdf is None:
+            logger.warning("Drawing pages in parallel needs pypdf, using one process")
+            jobs = 1
+        self.jobs = jobs
+
+        self.filename = filename
+        if self.jobs == 1:
+            self.surface, self.cr = self.create_context(filename)
 
-        self.surface = qh.PDFSurface.create(
-            filename, (self.page_width, self.page_height)
-        )
-        cr = self.cr = qh.Context.create(self.surface)
+        self.chapters = chapters
+
+    def create_context(self, filename):
+        """Creates a PDF surface and a drawing context set up for it."""
+
+        surface = qh.PDFSurface.create(filename, (self.page_width, self.page_height))
+        cr = qh.Context.create(surface)
         cr.set_font_face(self.shaper.make_qahira_face())
         cr.set_font_size(self.body_font_size)
         cr.set_source_colour(qh.Colour.grey(0))
 
-        self.chapters = chapters
+        return surface, cr
 
     def save(self):
         lines = self._create_lines()
         pages = self._create_pages(lines)
 
+        self.verse_cache.save()
+
         logger.info("Drawing pages…")
+        if self.jobs > 1:
+            self._draw_pages_parallel(pages)
+            return
+
         for page in pages:
             page.draw(self.cr)
 
         del self.cr
+        self.surface.finish()
         del self.surface
 
+    def _draw_pages_parallel(self, pages):
+        """
+        Draws ranges of pages in forked worker processes, each to its own PDF
+        file, then merges the files in order into the output file. The workers
+        inherit the pages, so nothing needs to be sent to them but the page
+        ranges. Identical objects in the parts are merged when the pypdf
+        version supports it, but font subsets are per part.
+        """
+
+        global _worker_doc, _worker_pages
+
+        # Use more ranges than workers, to balance the load.
+        size = max(1, math.ceil(len(pages) / (self.jobs * 4)))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ranges = []
+            for i, start in enumerate(range(0, len(pages), size)):
+                filename = os.path.join(tmpdir, "part-%04d.pdf" % i)
+                ranges.append((start, start + size, filename))
+
+            _worker_doc, _worker_pages = self, pages
+            try:
+                context = multiprocessing.get_context("fork")
+                with context.Pool(self.jobs) as pool:
+                    parts = pool.map(_draw_pages_worker, ranges)
+            finally:
+                _worker_doc = _worker_pages = None
+
+            logger.info("Merging %d parts…", len(parts))
+            writer = pypdf.PdfWriter()
+            for part in parts:
+                writer.append(part)
+            if hasattr(writer, "compress_identical_objects"):
+                writer.compress_identical_objects()
+            writer.write(self.filename)
+
     def _create_lines(self):
         """Processes each chapter and creates lines for the whole document."""
 
@@ -121,21 +208,33 @@ class Document:
 
         lines = [self._create_heading(chapter)]
 
-        start = 0
-        for i, breakpoint in enumerate(breaks[1:]):
-            ratio = nodes.compute_adjustment_ratio(start, breakpoint, i, lengths)
+        # The nodes are left as they are, each line keeps the ratio to
+        # adjust its glue by.
+        for start, end, ratio in nodes.compute_lines(breaks, lengths):
+            lines.append(Line(self, nodes[start:end], ratio))
+
+        return lines
 
-            boxes = []
-            for j in range(start, breakpoint):
-                box = nodes[j]
-                box.ratio = ratio
-                boxes.append(box)
 
-            lines.append(Line(self, boxes))
+# State of worker processes used by Document._draw_pages_parallel().
+_worker_doc = None
+_worker_pages = None
 
-            start = breakpoint + 1
 
-        return lines
+def _draw_pages_worker(page_range):
+    """Draws a range of pages in a worker process to the given file."""
+
+    start, end, filename = page_range
+    surface, cr = _worker_doc.create_context(filename)
+    for page in _worker_pages[start:end]:
+        page.draw(cr)
+
+    # Finish the file before handing it over: pool workers exit without
+    # running finalizers, so we can’t count on the surface being destroyed.
+    del cr
+    surface.finish()
+
+    return filename
 
 
 class Chapter:
@@ -156,6 +255,26 @@ class Chapter:
         return text
 
 
+class LRUCache(OrderedDict):
+    """Dictionary holding at most maxsize items, dropping the least recently
+    used ones first."""
+
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
 def _get_glyph(font, font_data, unicode, user_data):
     if unicode > GID_OFFSET:
         return unicode - GID_OFFSET
@@ -165,23 +284,79 @@ def _get_glyph(font, font_data, unicode, user_data):
 class Shaper:
     """Class for turning text into boxes and glue."""
 
+    # Stretched and shrunk boxes snap their axis value to one of this many
+    # steps, so that boxes with close ratios share fonts and reshaping results.
+    variation_steps = 64
+
+    # Maximum number of per-variation HarfBuzz fonts, Cairo font faces and
+    # reshaped glyph runs to keep around. The faces are enough for the
+    # variation_steps + 1 values of both axes and the default, so none is
+    # ever evicted: a recreated face would be a new font face to Cairo, and
+    # the PDF would embed the same variation again. The fonts also include
+    # the two measuring the ends of the axes.
+    face_cache_size = 2 * (variation_steps + 1) + 1
+    font_cache_size = face_cache_size + 2
+    reshape_cache_size = 4096
+
     def __init__(self, doc):
-        self.cache = {"hb": {}, "ft": {}}
+        self.cache = {
+            "hb": LRUCache(self.font_cache_size),
+            "ft": LRUCache(self.face_cache_size),
+            "reshape": LRUCache(self.reshape_cache_size),
+            "colr": {},
+        }
 
         self._font_funcs = hb.FontFuncs.create(True)
         self._font_funcs.set_nominal_glyph_func(_get_glyph, None, None)
 
         self.doc = doc
 
-        blob = hb.Blob.create_from_file(doc.body_font)
+        # The font file is read once, and the data is shared by HarfBuzz and
+        # all the FreeType faces. It must outlive them, Cairo’s references to
+        # the faces included, so we keep it for the lifetime of the shaper.
+        with open(doc.body_font, "rb") as fontfile:
+            self.font_data = fontfile.read()
+        blob = hb.Blob.create_for_array(
+            self.font_data, hb.HARFBUZZ.MEMORY_MODE_READONLY
+        )
         self.face = hb.Face.create(blob, 0, True)
         self.font = self.make_font()
 
+        doc.verse_cache.load(self.get_cache_key())
+
         self.buffer = hb.Buffer.create()
 
         self.minfont, self.minaxis = self.make_var_font("ASHR")
         self.maxfont, self.maxaxis = self.make_var_font("ASTR")
 
+        # Advance widths of all glyphs, at the default, minimum and maximum
+        # widths, for computing the stretch and shrink of boxes.
+        glyphs = range(self.face.glyph_count)
+        self.advances = self.font.get_glyph_h_advances(glyphs)
+        self.minadvances = self.minfont.get_glyph_h_advances(glyphs)
+        self.maxadvances = self.maxfont.get_glyph_h_advances(glyphs)
+
+        self.palette = []
+        for colour in self.face.ot_colour_palette_get_colours(0):
+            colour = (
+                hb.HARFBUZZ.colour_get_red(colour),
+                hb.HARFBUZZ.colour_get_green(colour),
+                hb.HARFBUZZ.colour_get_blue(colour),
+                hb.HARFBUZZ.colour_get_alpha(colour),
+            )
+            self.palette.append(tuple(c / 255 for c in colour))
+
+    def get_cache_key(self):
+        """
+        Returns a tuple identifying everything that affects the shaping
+        results, used to key the persistent verse cache.
+        """
+        return (
+            hashlib.sha256(self.font_data).hexdigest(),
+            self.doc.body_font_size,
+            hb.version_string(),
+        )
+
     def make_font(self, variations=None, funcs=None):
         cache = self.cache["hb"]
         key = f"{variations}:{funcs}"
@@ -205,7 +380,7 @@ class Shaper:
     def make_qahira_face(self, variations=None):
         cache = self.cache["ft"]
         if variations not in cache:
-            ft_face = ft.new_face(self.doc.body_font)
+            ft_face = ft.new_memory_face(self.font_data)
             if variations:
                 variation = hb.Variation.from_string(variations)
                 axes = ft_face.mm_var["axis"]
@@ -221,6 +396,19 @@ class Shaper:
             cache[variations] = qh.FontFace.create_for_ft_face(ft_face)
         return cache[variations]
 
+    def get_colour_layers(self, index):
+        """
+        Returns the COLR layers of the glyph as a tuple of (layer glyph,
+        colour) pairs, or an empty tuple if the glyph has no colour layers.
+        """
+        cache = self.cache["colr"]
+        if index not in cache:
+            layers = self.face.ot_colour_glyph_get_layers(index) or ()
+            cache[index] = tuple(
+                (layer.glyph, self.palette[layer.colour_index]) for layer in layers
+            )
+        return cache[index]
+
     def clear_buffer(self, direction=hb.HARFBUZZ.DIRECTION_RTL):
         buf = self.buffer
 
@@ -238,53 +426,81 @@ class Shaper:
 
         return buf
 
-    def reshape(self, glyphs, variations):
-        font = self.make_font(variations, self._font_funcs)
-        buf = self.clear_buffer()
-        codepoints = [g.index + GID_OFFSET for g in reversed(glyphs)]
-        buf.add_codepoints(codepoints, len(codepoints), 0, len(codepoints))
-        hb.shape(font, buf)
+    def get_variations(self, ratio):
+        """
+        Returns the variations string for stretching (positive ratio) or
+        shrinking (negative ratio) a box, with the axis value snapped to
+        one of variation_steps steps. Ratios beyond 1 get the end of the
+        axis, as the font would clamp them to it anyway.
+        """
+        axis = self.maxaxis if ratio > 0 else self.minaxis
+        step = min(round(abs(ratio) * self.variation_steps), self.variation_steps)
+        value = step * (axis.max_value - axis.default_value) / self.variation_steps
+        return f"{axis.tag}={value}"
 
-        return buf.get_glyphs()[0]
+    def reshape(self, glyphs, variations):
+        cache = self.cache["reshape"]
+        key = (tuple(g.index for g in glyphs), variations)
+        if key not in cache:
+            font = self.make_font(variations, self._font_funcs)
+            buf = self.clear_buffer()
+            codepoints = [g.index + GID_OFFSET for g in reversed(glyphs)]
+            buf.add_codepoints(codepoints, len(codepoints), 0, len(codepoints))
+            hb.shape(font, buf)
+            cache[key] = buf.get_glyphs()[0]
+        return cache[key]
 
     @staticmethod
-    def next_is_nonjoining(text, infos, index):
-        if index < len(infos):
-            cluster = infos[index].cluster
+    def next_is_nonjoining(text, clusters, index):
+        if index < len(clusters):
+            cluster = clusters[index]
             category = unicodedata.category(text[cluster])
             return category[0] != "L"
         return True
 
     def shape_verse(self, verse, mark=None):
         """
-        Shapes a single verse and returns the corresponding nodes.
+        Shapes a single verse and returns the corresponding nodes. Verses
+        repeat, so we cache the nodes of shaped verses and create new nodes
+        from the cache for each repetition.
         """
 
+        cache = self.doc.verse_cache
+        key = (verse, mark)
+        if key in cache:
+            return [node_from_tuple(self.doc, t, NODE_KINDS) for t in cache[key]]
+
+        nodes = self._shape_verse(verse, mark)
+        cache[key] = [node_to_tuple(node) for node in nodes]
+
+        return nodes
+
+    def _shape_verse(self, verse, mark):
         buf = self.shape(verse, hb.HARFBUZZ.DIRECTION_RTL)
 
         nodes = []
-        infos = buf.glyph_infos
-        positions = buf.glyph_positions
-        flip = qh.Vector(1, -1)
-        i = len(infos) - 1
+        codepoints, clusters = buf.glyph_info_arrays
+        x_advances, y_advances, x_offsets, y_offsets = buf.glyph_position_arrays
+        i = len(codepoints) - 1
         while i >= 0:
             # Find all indices with same cluster
             j = i
-            while j >= 0 and infos[i].cluster == infos[j].cluster:
+            while j >= 0 and clusters[i] == clusters[j]:
                 j -= 1
 
             # Collect all glyphs in this cluster, iterating backwards to get
             # glyphs in the visual order.
-            pos = qh.Vector(0, 0)
+            x = y = 0
             glyphs = []
             for k in reversed(range(i, j, -1)):
                 glyphs.append(
-                    qh.Glyph(infos[k].codepoint, pos + flip * positions[k].offset)
+                    qh.Glyph(codepoints[k], (x + x_offsets[k], y - y_offsets[k]))
                 )
-                pos += flip * positions[k].advance
+                x += x_advances[k]
+                y -= y_advances[k]
 
             # The chars in this cluster
-            chars = verse[infos[i].cluster : infos[j].cluster]
+            chars = verse[clusters[i] : clusters[j]]
 
             # We skip space since the font kerns with it and we will turn these
             # kerns into glue below.
@@ -295,17 +511,18 @@ class Shaper:
                     if not unicodedata.combining(ch):
                         base = ch
 
-                adv = self.font.get_glyph_h_advance(glyphs[-1].index)
-                minadv = self.minfont.get_glyph_h_advance(glyphs[-1].index)
-                maxadv = self.maxfont.get_glyph_h_advance(glyphs[-1].index)
+                index = glyphs[-1].index
+                adv = self.advances[index]
+                minadv = self.minadvances[index]
+                maxadv = self.maxadvances[index]
 
                 shrink = adv - minadv
                 stretch = maxadv - adv
 
-                if base in RIGH_JOINING or self.next_is_nonjoining(verse, infos, j):
+                if base in RIGH_JOINING or self.next_is_nonjoining(verse, clusters, j):
                     # Get the difference between the original advance width and
                     # the advance width after OTL.
-                    kern = positions[k].advance - qh.Vector(adv, 0)
+                    kern = qh.Vector(x_advances[k] - adv, y_advances[k])
 
                     # Re-adjust glyph positions.
                     glyphs = [qh.Glyph(g.index, g.pos - kern) for g in glyphs]
@@ -314,10 +531,10 @@ class Shaper:
                     # Add glue with the kerning amount with minimal stretch and shrink.
                     nodes.append(Glue(self.doc, kern.x, kern.x / 8.5, kern.x / 8.5))
                 else:
-                    nodes.append(Box(self.doc, chars, glyphs, pos.x, stretch, shrink))
-            elif pos.x != 0:
+                    nodes.append(Box(self.doc, chars, glyphs, x, stretch, shrink))
+            elif x != 0:
                 # If space is not zero-width, add glue for it.
-                nodes.append(Glue(self.doc, pos.x, pos.x / 8.5, pos.x / 8.5))
+                nodes.append(Glue(self.doc, x, x / 8.5, x / 8.5))
 
             i = j
 
@@ -360,6 +577,51 @@ class Shaper:
         return nodes
 
 
+class VerseCache(dict):
+    """
+    Cache of shaped verses, keyed by verse text and aya mark. If a cache
+    directory is given, the cache is loaded from and saved to a file whose
+    name is derived from the shaper’s cache key, so that changing the font,
+    its size or the HarfBuzz version never reuses stale entries.
+    """
+
+    # Bump this when the stored node format changes.
+    version = 1
+
+    def __init__(self, cache_dir=None):
+        super().__init__()
+        self.cache_dir = cache_dir
+        self.path = None
+        self.dirty = False
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.dirty = True
+
+    def load(self, key):
+        if self.cache_dir is None:
+            return
+
+        self.path = cache_path(self.cache_dir, "verses", self.version, key)
+        verses = load_pickle(self.path, "verse cache")
+        if verses is None:
+            return
+
+        self.update(verses)
+        self.dirty = False
+
+        logger.info("Loaded %d verses from cache: %s", len(verses), self.path)
+
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+
+        logger.info("Saving %d verses to cache: %s", len(self), self.path)
+        save_pickle(self.path, dict(self))
+
+        self.dirty = False
+
+
 class Page:
     """Class representing a page of text."""
 
@@ -372,7 +634,6 @@ class Page:
         logger.info("Page %d…", self.number)
 
         shaper = self.doc.shaper
-        self.cr = cr
 
         if not self.lines:
             logger.debug("Leaving empty page blank")
@@ -389,103 +650,152 @@ class Page:
 
 
 class Glue(linebreak.Glue):
+    kind = "glue"
+
     def __init__(self, doc, width, stretch, shrink):
         super().__init__(width=width, stretch=stretch, shrink=shrink)
         self.doc = doc
 
-    def draw(self, cr, pos, drawColorLayers):
-        width = self.compute_width()
+    def to_tuple(self):
+        return (self.width, self.stretch, self.shrink)
+
+    @classmethod
+    def from_tuple(cls, doc, t):
+        return cls(doc, *t)
+
+    def draw(self, cr, pos, runs, ratio=None):
+        width = self.compute_width(ratio)
         x, y = pos.x - width, pos.y
 
         if self.doc.debug and width != self.width:
-            cr.save()
-            if self.ratio > 0:
-                cr.set_source_colour((0, 1, 0, 0.2))
-            else:
-                cr.set_source_colour((0, 0, 1, 0.2))
-            cr.rectangle(qh.Rect(x, y, width, -5))
-            cr.fill()
-            cr.restore()
+            colour = (0, 1, 0, 0.2) if ratio > 0 else (0, 0, 1, 0.2)
+            runs.add_rect(colour, qh.Rect(x, y, width, -5))
 
         return x
 
 
 class Box(linebreak.Box):
+    kind = "box"
+
     def __init__(self, doc, text, glyphs, width, stretch=0, shrink=0):
         super().__init__(width=width, stretch=stretch, shrink=shrink)
         self.doc = doc
         self.text = text
         self.glyphs = glyphs
 
-    def draw(self, cr, pos, drawColorLayers):
-        cr.save()
+    def to_tuple(self):
+        glyphs = [(g.index, g.pos.x, g.pos.y) for g in self.glyphs]
+        return (self.text, glyphs, self.width, self.stretch, self.shrink)
+
+    @classmethod
+    def from_tuple(cls, doc, t):
+        text, glyphs, width, stretch, shrink = t
+        glyphs = [qh.Glyph(index, (x, y)) for index, x, y in glyphs]
+        return cls(doc, text, glyphs, width, stretch, shrink)
+
+    def draw(self, cr, pos, runs, ratio=None):
+        """
+        Adds the glyphs of the box, adjusted by ratio, to the glyph runs of
+        the line, which draws them later, and returns the position of the
+        next box.
+        """
         glyphs = self.glyphs
         shaper = self.doc.shaper
-        face = shaper.font.face
 
-        width = self.compute_width()
+        width = self.compute_width(ratio)
         x, y = pos.x - width, pos.y
-        cr.translate((x, y))
+        offset = qh.Vector(x, y)
 
+        variations = None
         if width != self.width:
-            axis = shaper.maxaxis if self.ratio > 0 else shaper.minaxis
-            value = abs(self.ratio) * (axis.max_value - axis.default_value)
-            variations = f"{axis.tag}={value}"
-
+            variations = shaper.get_variations(ratio)
             glyphs = shaper.reshape(glyphs, variations)
-            cr.set_font_face(shaper.make_qahira_face(variations))
-
-        colors = face.ot_colour_palette_get_colours(0)
 
         for glyph in glyphs:
-            layers = face.ot_colour_glyph_get_layers(glyph.index)
-            if layers and drawColorLayers:
-                for layer in layers:
-                    color = colors[layer.colour_index]
-                    color = [
-                        hb.HARFBUZZ.colour_get_red(color),
-                        hb.HARFBUZZ.colour_get_green(color),
-                        hb.HARFBUZZ.colour_get_blue(color),
-                        hb.HARFBUZZ.colour_get_alpha(color),
-                    ]
-                    color = [c / 255 for c in color]
-                    lglyph = qh.Glyph(layer.glyph, glyph.pos)
-                    cr.save()
-                    cr.set_source_colour(color)
-                    cr.show_glyphs([lglyph])
-                    cr.restore()
-            elif not layers and not drawColorLayers:
-                cr.show_glyphs([glyph])
-        cr.restore()
+            glyph_pos = glyph.pos + offset
+            layers = shaper.get_colour_layers(glyph.index)
+            if layers:
+                for index, colour in layers:
+                    runs.add(variations, colour, qh.Glyph(index, glyph_pos))
+            else:
+                runs.add(variations, None, qh.Glyph(glyph.index, glyph_pos))
 
         if self.doc.debug and width != self.width:
+            colour = (0, 1, 0, 0.2) if ratio > 0 else (0, 0, 1, 0.2)
+            runs.add_rect(colour, qh.Rect(x, y - self.doc.leading + 30, width, 5))
+
+        return x
+
+
+# Node classes by kind, for node_from_tuple().
+NODE_KINDS = {cls.kind: cls for cls in (Box, Glue)}
+
+
+class GlyphRuns:
+    """
+    Class collecting the glyphs of a line, so that each run of consecutive
+    glyphs with the same font variations and colour is drawn with a single
+    show_glyphs call.
+
+    As when drawing glyph by glyph, glyphs without colour layers are drawn
+    first with the current source colour, then the colour layers in the
+    order of their glyphs, and the layers of each glyph in their COLR order,
+    back to front, as they can overlap. Debugging rectangles are drawn last,
+    on top of the glyphs.
+    """
+
+    def __init__(self):
+        self.plain = []
+        self.layers = []
+        self.rects = []
+
+    def add(self, variations, colour, glyph):
+        runs = self.plain if colour is None else self.layers
+        key = (variations, colour)
+        if runs and runs[-1][0] == key:
+            runs[-1][1].append(glyph)
+        else:
+            runs.append((key, [glyph]))
+
+    def add_rect(self, colour, rect):
+        self.rects.append((colour, rect))
+
+    def draw(self, cr, shaper):
+        for (variations, colour), glyphs in self.plain + self.layers:
             cr.save()
-            if self.ratio > 0:
-                cr.set_source_colour((0, 1, 0, 0.2))
-            else:
-                cr.set_source_colour((0, 0, 1, 0.2))
-            cr.rectangle(qh.Rect(x, y - self.doc.leading + 30, width, 5))
-            cr.fill()
+            if variations:
+                cr.set_font_face(shaper.make_qahira_face(variations))
+            if colour is not None:
+                cr.set_source_colour(colour)
+            cr.show_glyphs(glyphs)
             cr.restore()
 
-        return x
+        for colour, rect in self.rects:
+            cr.save()
+            cr.set_source_colour(colour)
+            cr.rectangle(rect)
+            cr.fill()
+            cr.restore()
 
 
 class Line:
     """Class representing a line of text."""
 
-    def __init__(self, doc, boxes):
+    def __init__(self, doc, boxes, ratio=None):
         self.doc = doc
         self.height = doc.leading
         self.boxes = boxes
+        # Adjustment ratio of the glue between the boxes.
+        self.ratio = ratio
 
     def draw(self, cr, pos):
         self.strip()
 
-        for drawColorLayers in (False, True):
-            p = qh.Vector(pos.x, pos.y)
-            for box in self.boxes:
-                p.x = box.draw(cr, p, drawColorLayers)
+        runs = GlyphRuns()
+        p = qh.Vector(pos.x, pos.y)
+        for box in self.boxes:
+            p.x = box.draw(cr, p, runs, self.ratio)
+        runs.draw(cr, self.doc.shaper)
 
     def strip(self):
         while self.boxes and not self.boxes[-1].is_box:
@@ -534,8 +844,98 @@ def read_data(datadir):
     return chapters
 
 
-def main(chapters, filename, debug):
-    document = Document(chapters, filename, debug)
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Handles a server request, see serve()."""
+
+    def handle(self):
+        start = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.readline())
+            self.server.typeset(request)
+        except Exception as e:
+            logger.exception("Request failed")
+            response = {"ok": False, "error": str(e)}
+        else:
+            response = {"ok": True, "time": time.perf_counter() - start}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class Server(socketserver.UnixStreamServer):
+    """
+    Server typesetting documents on request, keeping the shapers, verse caches
+    and fonts of earlier requests. Requests are handled one at a time.
+    """
+
+    def __init__(self, path):
+        remove_stale_socket(path)
+        super().__init__(path, RequestHandler)
+        self.resident = {}
+
+    def typeset(self, request):
+        all_chapters = read_data(request["datadir"])
+        if all_chapters is None:
+            raise ValueError("Can’t read data: %s" % request["datadir"])
+        numbers = request.get("chapters", range(1, 115))
+        chapters = [all_chapters[i] for i in numbers]
+
+        document = Document(
+            chapters,
+            request["outfile"],
+            request.get("debug", False),
+            request.get("cache_dir"),
+            request.get("jobs", 1),
+            self.resident,
+        )
+        document.save()
+
+
+def remove_stale_socket(path):
+    """
+    Removes the socket at path if it is left from a server that did not exit
+    cleanly, i.e. nothing is listening on it. Anything else at path is left
+    alone, for binding to fail.
+    """
+
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            logger.info("Removing stale socket: %s", path)
+            os.unlink(path)
+
+
+def serve(path):
+    """
+    Runs a server listening on a Unix socket at path. Each connection sends
+    one request, a line of JSON with the arguments of a typesetter run, and
+    gets back one line of JSON, {"ok": true, "time": SECONDS} or {"ok": false,
+    "error": MESSAGE}. Request keys, all optional but datadir and outfile:
+
+        datadir, outfile, chapters, debug, cache_dir, jobs:
+            As the command line arguments.
+
+    Paths are relative to the working directory of the server. For example:
+
+        echo '{"datadir": "/data", "outfile": "/tmp/out.pdf", "chapters": [1]}' \\
+            | socat - UNIX-CONNECT:raqq.sock
+    """
+
+    with Server(path) as server:
+        logger.info("Listening on %s", path)
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+def main(chapters, filename, debug, cache_dir, jobs):
+    document = Document(chapters, filename, debug, cache_dir, jobs)
     document.save()
 
 
@@ -546,9 +946,12 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Quran Typesetter.")
     parser.add_argument(
-        "datadir", metavar="DATADIR", help="Directory containing input files to process"
+        "datadir",
+        metavar="DATADIR",
+        nargs="?",
+        help="Directory containing input files to process",
     )
-    parser.add_argument("outfile", metavar="OUTFILE", help="Output file")
+    parser.add_argument("outfile", metavar="OUTFILE", nargs="?", help="Output file")
     parser.add_argument(
         "--chapters",
         "-c",
@@ -562,6 +965,24 @@ if __name__ == "__main__":
     parser.add_argument(
         "--debug", "-d", action="store_true", help="Draw some debugging aids"
     )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Directory for keeping shaped verses between runs (Default: none)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        metavar="N",
+        type=int,
+        default=1,
+        help="Number of processes for drawing pages, needs pypdf (Default: 1)",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help="Typeset documents on requests to a Unix socket, keeping fonts loaded",
+    )
     parser.add_argument(
         "--quite", "-q", action="store_true", help="Don’t print normal messages"
     )
@@ -570,12 +991,18 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
+    if args.serve is None and (args.datadir is None or args.outfile is None):
+        parser.error("DATADIR and OUTFILE are required")
 
     if args.verbose:
         logger.setLevel(logging.DEBUG)
     if args.quite:
         logger.setLevel(logging.ERROR)
 
+    if args.serve is not None:
+        serve(args.serve)
+        sys.exit(0)
+
     all_chapters = read_data(args.datadir)
     if all_chapters is None:
         sys.exit(1)
@@ -584,4 +1011,4 @@ if __name__ == "__main__":
     for i in args.chapters:
         chapters.append(all_chapters[i])
 
-    main(chapters, args.outfile, args.debug)
+    main(chapters, args.outfile, args.debug, args.cache_dir, args.jobs)
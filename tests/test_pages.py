@@ -0,0 +1,99 @@
+"""Tests for breaking the lines of the document into pages."""
+
+import importlib.util
+import os
+import random
+import types
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_typesetter():
+    path = os.path.join(ROOT, "quran-typesetter.py")
+    spec = importlib.util.spec_from_file_location("quran_typesetter", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+typesetter = load_typesetter()
+
+
+class PageBreakingTest(unittest.TestCase):
+    def setUp(self):
+        # Only what breaking lines into pages uses, no fonts needed.
+        self.doc = types.SimpleNamespace(leading=29, lines_per_page=12)
+
+    def make_chapter(self, count, opening=False):
+        """Returns the lines of a chapter the way Document does."""
+
+        doc = self.doc
+        lines = [typesetter.Heading(doc, [])]
+        if opening:
+            lines.append(typesetter.Line(doc, []))
+        for i in range(count):
+            lines.append(typesetter.Line(doc, []))
+            lines.append(typesetter.LineGlue(doc))
+        lines[-1].stretch = doc.leading
+        return lines
+
+    def make_chapters(self, seed):
+        rng = random.Random(seed)
+        return [
+            self.make_chapter(rng.randint(1, 30), rng.random() < 0.9)
+            for i in range(100)
+        ]
+
+    def break_streamed(self, chapters):
+        pages = typesetter.Document._create_pages(self.doc, chapters)
+        return [(page.lines, page.ratio) for page in pages][1:]
+
+    def break_at_once(self, chapters):
+        lines = typesetter.LineList(self.doc)
+        for chapter in chapters:
+            lines.extend(chapter)
+        lengths = [self.doc.leading * self.doc.lines_per_page]
+        breaks = lines.compute_breakpoints(lengths)
+        return [
+            (lines[start:end], min(ratio, lines.max_stretch))
+            for start, end, ratio in lines.compute_lines(breaks, lengths)
+        ]
+
+    def assertSamePages(self, streamed, at_once):
+        self.assertEqual(len(streamed), len(at_once))
+        for (lines, ratio), (other_lines, other_ratio) in zip(streamed, at_once):
+            self.assertEqual([id(l) for l in lines], [id(l) for l in other_lines])
+            self.assertAlmostEqual(ratio, other_ratio)
+
+    def test_streamed_breaks_match(self):
+        for seed in range(10):
+            chapters = self.make_chapters(seed)
+            with self.subTest(seed=seed):
+                self.assertSamePages(
+                    self.break_streamed(chapters), self.break_at_once(chapters)
+                )
+
+    def test_full_page(self):
+        # Five headings and three lines fill a page exactly, but summing
+        # their heights after a page of lines comes out a hair too long.
+        doc = self.doc
+        lines = typesetter.LineList(doc)
+        for kind in "LLLLLLLLLLLL" + "LHHLHHHL":
+            if kind == "H":
+                lines.append(typesetter.Heading(doc, []))
+            else:
+                lines.append(typesetter.Line(doc, []))
+            lines.append(typesetter.LineGlue(doc))
+        lengths = [doc.leading * doc.lines_per_page]
+        self.assertEqual(lines.compute_breakpoints(lengths), [0, 23, 39])
+
+    def test_no_lines(self):
+        lines = typesetter.LineList(self.doc)
+        self.assertEqual(lines.compute_breakpoints([348]), [0])
+        self.assertEqual(lines.compute_breakpoints([348], False), [0])
+        self.assertEqual(self.break_streamed([]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()